@@ -0,0 +1,94 @@
+"""ai.py - Server-side AI player for single-player games.
+
+Moves are chosen by a negamax search with alpha-beta pruning over the
+bitboards of engine.py. Searched positions are memoized in a transposition
+table shared by every request of the instance, bounded in size with least
+recently used eviction, so after the first few games most replies are a
+handful of table lookups."""
+
+import random
+
+import engine
+from lru import LRUCache
+
+EASY, MEDIUM, HARD = 'easy', 'medium', 'hard'
+
+# Number of plies searched ahead for each level. Easy plays at random.
+LEVELS = {EASY: 0, MEDIUM: 2, HARD: 9}
+
+TABLE_SIZE = 50000
+
+EXACT, LOWER, UPPER = range(3)
+
+# Center first, then corners, then edges: good moves first prune the most.
+MOVE_ORDER = (5, 1, 3, 7, 9, 2, 4, 6, 8)
+
+transposition_table = LRUCache(TABLE_SIZE)
+
+
+def _negamax(mover, other, depth, alpha, beta):
+    """Returns the score of the position for the player to move, looking at
+    most depth plies ahead. Wins score higher the sooner they happen"""
+    free = engine.free_mask(mover, other)
+    if engine.is_winner(other):
+        return -1 - bin(free).count('1')
+    if not free or not depth:
+        return 0
+
+    key = (mover << 9 | other) << 4 | depth
+    entry = transposition_table.get(key)
+    if entry is not None:
+        value, flag = entry
+        if flag == EXACT:
+            return value
+        if flag == LOWER:
+            alpha = max(alpha, value)
+        else:
+            beta = min(beta, value)
+        if alpha >= beta:
+            return value
+
+    original_alpha = alpha
+    best = None
+    for position in MOVE_ORDER:
+        mask = engine.BITS[position - 1]
+        if not free & mask:
+            continue
+        value = -_negamax(other, mover | mask, depth - 1, -beta, -alpha)
+        if best is None or value > best:
+            best = value
+        if value > alpha:
+            alpha = value
+            if alpha >= beta:
+                break
+
+    if best <= original_alpha:
+        flag = UPPER
+    elif best >= beta:
+        flag = LOWER
+    else:
+        flag = EXACT
+    transposition_table.put(key, (best, flag))
+    return best
+
+
+def choose_move(mover, other, level=HARD):
+    """Returns the position (1-9) the AI plays, where mover is the AI's
+    bitboard and other the bitboard of its oppoent"""
+    moves = engine.legal_moves(mover, other)
+    if not moves:
+        raise ValueError('No move left on the board')
+    depth = LEVELS[level]
+    if not depth:
+        return random.choice(moves)
+
+    alpha, beta = -10, 10
+    best_move = None
+    for position in MOVE_ORDER:
+        mask = engine.BITS[position - 1]
+        if (mover | other) & mask:
+            continue
+        value = -_negamax(other, mover | mask, depth - 1, -beta, -alpha)
+        if best_move is None or value > alpha:
+            alpha, best_move = value, position
+    return best_move
@@ -6,15 +6,40 @@ primarily with communication to/from the API's players."""
 
 
 import logging
+import os
 import endpoints
 from protorpc import remote, messages
 from google.appengine.api import memcache, mail
-from google.appengine.api import taskqueue
+from google.appengine.ext import ndb
 
-from models import Player, Game, Score
-from forms import StringMessage, NewGameForm, GameForm, MakeMoveForm,\
-    UserForms, ScoreForms
-from utils import get_by_urlsafe, check_winner, check_full
+from models import Player, Game, Score, GameState, ActiveGames,\
+    GameInSessionError, PlayerExistsError
+from forms import StringMessage, NewGameForm, GameForm, GameForms,\
+    MakeMoveForm, UserForms, ScoreForms, HintForm, CacheStatsForm, RankForm,\
+    BatchMovesForm, MoveResultForm, MoveResultForms, NewTournamentForm,\
+    TournamentForm, ExportForm, PositionStatsForm, OpeningStatsForm,\
+    OpeningProfileForm, ProfileForms
+from utils import get_by_urlsafe, get_key_by_urlsafe, get_cursor_by_urlsafe
+import ai
+import cache
+import engine
+import export
+import gametree
+import leaderboard
+import longpoll
+import matchmaking
+import outbox
+import profiling
+import stats
+import symmetry
+import tournament
+
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+MAX_BATCH_MOVES = 100
+MAX_EXPORT_PAGE_SIZE = 500
+# Entity groups of a cross-group transaction
+MAX_BATCH_GROUPS = 25
 
 NEW_GAME_REQUEST = endpoints.ResourceContainer(NewGameForm)
 GET_GAME_REQUEST = endpoints.ResourceContainer(
@@ -27,11 +52,44 @@ NEW_PLAYER_REQUEST = endpoints.ResourceContainer(
     email=messages.StringField(2))
 PLAYER_REQUEST = endpoints.ResourceContainer(
     player_name=messages.StringField(1))
+SCORES_REQUEST = endpoints.ResourceContainer(
+    player_name=messages.StringField(1),
+    limit=messages.IntegerField(2),
+    cursor=messages.StringField(3))
+WAIT_REQUEST = endpoints.ResourceContainer(
+    urlsafe_game_key=messages.StringField(1),
+    version=messages.IntegerField(2),
+    timeout=messages.IntegerField(3))
+RANKINGS_REQUEST = endpoints.ResourceContainer(
+    limit=messages.IntegerField(1),
+    cursor=messages.StringField(2))
+TOURNAMENT_REQUEST = endpoints.ResourceContainer(
+    urlsafe_tournament_key=messages.StringField(1),)
+POSITION_REQUEST = endpoints.ResourceContainer(
+    urlsafe_game_key=messages.StringField(1),
+    moves=messages.StringField(2))
 FORFEIT_REQUEST = endpoints.ResourceContainer(
     urlsafe_game_key=messages.StringField(1),
     player_name=messages.StringField(2))
 
 
+class _GameEnded(Exception):
+    """Raised to roll back a batch of moves when one of them ends its game"""
+
+
+def _check_admin():
+    """Raises an endpoints exception unless the caller is signed in with one
+    of the ADMIN_EMAILS (a comma-separated environment variable set in
+    app.yaml)"""
+    user = endpoints.get_current_user()
+    if not user:
+        raise endpoints.UnauthorizedException('Sign in as an administrator!')
+    admins = [email.strip().lower()
+              for email in os.environ.get('ADMIN_EMAILS', '').split(',')]
+    if not user.email() or user.email().lower() not in admins:
+        raise endpoints.ForbiddenException('Administrators only!')
+
+
 @endpoints.api(name='Tic-Tac-Toe', version='v1')
 class TicTacToeApi(remote.Service):
     """Game API"""
@@ -40,57 +98,61 @@ class TicTacToeApi(remote.Service):
                       path='player',
                       name='create_player',
                       http_method='POST')
+    @profiling.profiled
     def create_player(self, request):
-        """Create a Player. Requires a unique playername"""
-        if Player.get_player_by_name(request.player_name):
-            raise endpoints.ConflictException(
-                    'A Player with that name already exists!')
-
-        if mail.is_email_valid(request.email):
-            if Player.get_player_by_email(request.email):
-                raise endpoints.ConfictException(
-                    'A Player with that email already exists!')
-            else:
-                player = Player(name=request.player_name, email=request.email)
-                player.put()
-                return StringMessage(message='Player {} created!'.format(
-                    request.player_name))
-        else:
+        """Create a Player. Requires a unique playername and email"""
+        if not request.player_name:
+            raise endpoints.BadRequestException('Please enter a player name!')
+        if not mail.is_email_valid(request.email):
             raise endpoints.BadRequestException(
                 "Please enter a valid email address!")
+        try:
+            Player.create(request.player_name, request.email)
+        except PlayerExistsError as e:
+            raise endpoints.ConflictException(str(e))
+        return StringMessage(message='Player {} created!'.format(
+            request.player_name))
 
     @endpoints.method(request_message=NEW_GAME_REQUEST,
                       response_message=GameForm,
                       path='game',
                       name='new_game',
                       http_method='POST')
+    @profiling.profiled
     def new_game(self, request):
-        """Creates new game"""
-        host = Player.get_player_by_name(request.host_name)
-        oppoent = Player.get_player_by_name(request.oppoent_name)
+        """Creates new game. Leave oppoent_name out and set ai_level (easy,
+        medium or hard) to play against the AI"""
+        if request.ai_level:
+            if request.ai_level not in ai.LEVELS:
+                raise endpoints.BadRequestException(
+                    'Please choose an AI level: easy, medium or hard.')
+            host = Player.get_player_by_name_async(request.host_name)
+            oppoent = Player.get_ai_player_async(request.ai_level)
+            host, oppoent = host.get_result(), oppoent.get_result()
+        else:
+            host, oppoent = Player.get_players_by_name(
+                [request.host_name, request.oppoent_name])
 
         if host and oppoent:
-            games = Game.query(
-                ndb.AND(Game.host == host.key),
-                (Game.oppoent == oppoent.key)).filter(Game.status == 0)
-            if games:
-                raise endpoints.ConflictException(
-                    'A game is currently in session!')
             try:
-                game = Game.new_game(host.key, oppoent.key)
+                game = Game.new_game(host.key, oppoent.key, request.ai_level)
+            except GameInSessionError as e:
+                raise endpoints.ConflictException(str(e))
             except ValueError:
                 raise endpoints.BadRequestException(
                     'An error has occurred! Please try again')
         else:
             raise endpoints.NotFoundException(
                     'A minimum of 2 players is required!')
-        return game.to_form('Good luck!')
+        return game.to_form('Good luck!', {host.key: host,
+                                           oppoent.key: oppoent})
 
     @endpoints.method(request_message=GET_GAME_REQUEST,
                       response_message=GameForm,
                       path='game/{urlsafe_game_key}',
                       name='get_game',
                       http_method='GET')
+    @profiling.profiled
     def get_game(self, request):
         """Return the current game state."""
         game = get_by_urlsafe(request.urlsafe_game_key, Game)
@@ -100,137 +162,581 @@ class TicTacToeApi(remote.Service):
             raise endpoints.NotFoundException(
                 'Game not found! Please try again or start a new game.')
 
+    @endpoints.method(request_message=PLAYER_REQUEST,
+                      response_message=GameForms,
+                      path='player/{player_name}/games',
+                      name='list_my_games',
+                      http_method='GET')
+    @profiling.profiled
+    def list_my_games(self, request):
+        """Return the active games of a player"""
+        player = Player.get_player_by_name(request.player_name)
+        if not player:
+            raise endpoints.NotFoundException(
+                    'A Player with that name does not exist!')
+        index = ActiveGames.key_for(player.key).get()
+        games = ndb.get_multi(index.games) if index else []
+        return GameForms(items=[game.to_form('Ready to make a move?')
+                                for game in games if game])
+
+    @endpoints.method(request_message=WAIT_REQUEST,
+                      response_message=GameForm,
+                      path='game/{urlsafe_game_key}/wait',
+                      name='wait_for_turn',
+                      http_method='GET')
+    @profiling.profiled
+    def wait_for_turn(self, request):
+        """Wait until the game changes (a move is made or the game ends) or
+        the timeout (in seconds, 30 at most) expires, then return the game
+        state. Pass the version of the last GameForm returned by this
+        endpoint to only wait for changes made after it."""
+        game_key = get_key_by_urlsafe(request.urlsafe_game_key, Game)
+        # The game and the version it was read at, never an older game
+        # with a newer version
+        game, version = cache.get_with_version(game_key)
+        known = version if request.version is None else request.version
+        if game and game.status == GameState.Active and version == known:
+            timeout = request.timeout or longpoll.DEFAULT_TIMEOUT
+            if longpoll.poll(cache.get_version, game_key, known,
+                             timeout) != known:
+                game, version = cache.get_with_version(game_key)
+        if not game:
+            raise endpoints.NotFoundException('Game not found!')
+        form = game.to_form('Ready to make a move?')
+        form.version = version
+        return form
+
+    @endpoints.method(request_message=GET_GAME_REQUEST,
+                      response_message=HintForm,
+                      path='game/{urlsafe_game_key}/hint',
+                      name='get_hint',
+                      http_method='GET')
+    @profiling.profiled
+    def get_hint(self, request):
+        """Return the outcome under perfect play for the player of next turn,
+        the best moves and the number of moves left until the game ends."""
+        game = get_by_urlsafe(request.urlsafe_game_key, Game)
+        if not game:
+            raise endpoints.NotFoundException('Game not found!')
+        # The oppoent always goes first
+        evaluation = gametree.lookup(game.oppoent_board, game.host_board)
+        if not evaluation:
+            raise endpoints.BadRequestException(
+                'This position cannot be reached in a game!')
+        outcome, depth, best_moves = evaluation
+        return HintForm(urlsafe_key=request.urlsafe_game_key,
+                        outcome=gametree.OUTCOMES[outcome],
+                        depth=depth,
+                        best_moves=list(best_moves))
+
     @endpoints.method(request_message=FORFEIT_REQUEST,
                       response_message=StringMessage,
                       path='game/{urlsafe_game_key}/{player_name}/forfeit',
                       name='forfeit_game',
                       http_method='PUT')
+    @profiling.profiled
     def forfeit_game(self, request):
         """Forfeit a game. Send notification to the player of next turn
         that the oppoent has surrendered and that they have won the game"""
-        game = get_by_urlsafe(request.urlsafe_game_key, Game)
-        player = Player.get_player_by_name(request.player_name)
-        if game and player:
-            game.end_game(player, True)
-            taskqueue.add(url='/tasks/send_forfeit_email', params={
-                'user_key': game.next_turn.urlsafe(),
-                'game_key': game.key.urlsafe()})
-
-            taskqueue.add(url='/tasks/send_congrats_email', params={
-                'user_key': game.next_turn.urlsafe(),
-                'game_key': game.key.urlsafe()})
-
-            return StringMessage(message=(
-                'You have forfeited the game {}.'
-                .format(request.urlsafe_game_key)))
-        else:
-            raise NotFoundException(
+        game_key = get_key_by_urlsafe(request.urlsafe_game_key, Game)
+        player = Player.get_player_by_name_async(request.player_name)
+        self._forfeit_game_async(game_key, player).get_result()
+        return StringMessage(message=(
+            'You have forfeited the game {}.'
+            .format(request.urlsafe_game_key)))
+
+    @ndb.transactional_tasklet(xg=True)
+    def _forfeit_game_async(self, game_key, player):
+        """Ends the game as lost by the player, writing the Game, Score,
+        counters and notifications in one batch, enqueueing the tasks
+        meanwhile. player is the future of
+        the Player, read while the transaction reads the game"""
+        game, player = yield game_key.get_async(), player
+        if not game or not player or not game.check_player(player):
+            raise endpoints.NotFoundException(
                 'Game / Player not found! Please try again later.')
+        if game.status == GameState.Completed:
+            raise endpoints.NotFoundException('Game not in session!')
+        winner = game.oppoent if game.is_host(player) else game.host
+        notifications = []
+        if not game.is_ai(winner):
+            notifications = [(winner, outbox.FORFEIT),
+                             (winner, outbox.CONGRATS)]
+        entities, tasks = game.end_game(player, True)
+        events, enqueued = outbox.post_async(game.key, notifications, tasks)
+        yield ndb.put_multi_async(entities + events), enqueued
 
     @endpoints.method(request_message=MAKE_MOVE_REQUEST,
                       response_message=GameForm,
                       path='game/{urlsafe_game_key}',
                       name='make_move',
                       http_method='PUT')
+    @profiling.profiled
     def make_move(self, request):
         """Makes a move. Returns a game state with message"""
-        game = get_by_urlsafe(request.urlsafe_game_key, Game)
-        player = Player.get_player_by_name(request.player_name)
+        game_key = get_key_by_urlsafe(request.urlsafe_game_key, Game)
+        player = Player.get_player_by_name_async(request.player_name)
+        game, msg, players = self._make_move_async(
+            game_key, player, request.move).get_result()
+        return game.to_form(msg, players.get_result())
+
+    def _make_move(self, game_key, player, move):
+        """Like _make_move_async for a Player read already. Returns the game
+        and a message"""
+        found = ndb.Future()
+        found.set_result(player)
+        game, msg, _ = self._make_move_async(game_key, found,
+                                             move).get_result()
+        return game, msg
+
+    @ndb.transactional_tasklet(xg=True)
+    def _make_move_async(self, game_key, player, move):
+        """Applies the move in one transaction. player is the future of the
+        Player, read while the transaction reads the game. The entities and
+        the notifications are written with a single put_multi, while the
+        tasks are enqueued and the players of the game are read for the
+        form. Returns the game, a
+        message and the future of the players"""
+        game, player, ai_players = yield (game_key.get_async(), player,
+                                          Player.get_ai_players_async())
+        entities, tasks, notifications, msg = self._apply_move(
+            game, player, move, game and ai_players.get(game.ai_level))
+        players = game.get_players_async()
+        events, enqueued = outbox.post_async(game.key, notifications, tasks)
+        yield ndb.put_multi_async(entities + events), enqueued
+        raise ndb.Return(game, msg, players)
+
+    def _apply_move(self, game, player, move, ai_player=None):
+        """Checks and applies the move (and the AI's reply in a
+        single-player game) to the game. Returns the entities to put (the
+        Game, plus the Score and counters when the move ends the game, or
+        none if the move was refused), the tasks of end_game, the
+        notifications to post and a message. Raises an endpoints exception
+        if the game, player or turn is wrong. Pass the AI Player of a
+        single-player game if read already. Call from a transaction"""
         if not game:
             raise endpoints.NotFoundException('Game not found!')
-        if game.status == 1:
+        if game.status == GameState.Completed:
             raise endpoints.NotFoundException('Game not in session!')
-        if game.check_player(player):
-            if game.check_player_turn(player):
-                if 1 <= move <= 9:
-                    if move in game.setup:
-                        move = request.move
-                        game.history.append([player_name, move])
-                        if game.is_host(player):
-                            game.host_moves.append(move)
-                            if check_winner(game.host_moves):
-                                game.end_game(player)
-                                taskqueue.add(url='/tasks/send_congrats_email', params={
-                                    'user_key': game.host.urlsafe(),
-                                    'game_key': game.key.urlsafe()})
-                            else:
-                                game.next_turn = game.oppoent
-
-                        if game.is_oppoent(player):
-                            game.oppoent_moves.append(move)
-                            if check_winner(game.oppoent_moves):
-                                game.end_game(player)
-                                taskqueue.add(url='/tasks/send_congrats_email',
-                                        params={'user_key': game.oppoent.urlsafe(),
-                                                'game_key': game.key.urlsafe()})
-                            else:
-                                game.next_turn = game.host
-
-                    else:
-                        msg = 'Your oppoent has taken this spot. Please try again'
-                else:
-                    msg = 'Invalid move! Please choose a number (1-9).'
-            else:
-                raise endpoints.ConflictException('Please wait until your turn to make a move!')
-        else:
+        if not player or not game.check_player(player):
             raise endpoints.NotFoundException('Player not current game session!')
+        if not game.check_player_turn(player):
+            raise endpoints.ConflictException('Please wait until your turn to make a move!')
 
-        position = game.setup.index(move)
-        del game.setup[position]
-        game.put()
+        if not 1 <= move <= 9:
+            return [], [], [], 'Invalid move! Please choose a number (1-9).'
+        if not game.is_available(move):
+            return [], [], [], ('Your oppoent has taken this spot. '
+                                'Please try again')
 
-        if check_full(game.setup):
-            game.end_game()
+        won = game.add_move(player, move)
+        msg = 'Move accepted! Waiting for your oppoent.'
+        if not won and not game.is_full() and game.ai_level:
+            # The AI replies within the same request
+            player, move, won = game.play_ai_move(ai_player)
+            msg = '{} played {}. Your turn!'.format(player.name, move)
+
+        entities, tasks = [game], []
+        notifications = []
+        if won:
+            entities, tasks = game.end_game(player)
+            if game.is_ai(player.key):
+                msg = 'You lost! {} wins this game.'.format(player.name)
+            else:
+                msg = 'You win! Thank you for playing!'
+                notifications.append((player.key, outbox.CONGRATS))
+        elif game.is_full():
+            entities, tasks = game.end_game()
             msg = 'It\'s a tie! Thank you for playing!'
-            taskqueue.add(url='/tasks/send_finish_email',
-                          params={'user_key': game.next_turn.urlsafe(),
-                                  'game_key': game.key.urlsafe()})
-            taskqueue.add(url='/tasks/send_finish_email',
-                          params={'user_key': player.urlsafe(),
-                                  'game_key': game.key.urlsafe()})
-        else:
+            notifications = [(user_key, outbox.FINISH)
+                             for user_key in (game.host, game.oppoent)
+                             if not game.is_ai(user_key)]
+        elif not game.ai_level:
             # If game is still ongoing, send remainder email to player
-            taskqueue.add(url='/tasks/send_congrats_email',
-                          params={'user_key': game.next_turn.urlsafe(),
-                                  'game_key': game.key.urlsafe()})
-        return game.to_form(msg)
+            notifications.append((game.next_turn, outbox.MOVE))
+        return entities, tasks, notifications, msg
+
+    @endpoints.method(request_message=BatchMovesForm,
+                      response_message=MoveResultForms,
+                      path='games/moves',
+                      name='make_moves_batch',
+                      http_method='PUT')
+    @profiling.profiled
+    def make_moves_batch(self, request):
+        """Makes moves in many games at once, at most one per game. Returns
+        the game state with message, or the error, of each move in order"""
+        if len(request.moves) > MAX_BATCH_MOVES:
+            raise endpoints.BadRequestException(
+                'At most {} moves per batch!'.format(MAX_BATCH_MOVES))
+        game_keys = [get_key_by_urlsafe(item.urlsafe_game_key, Game)
+                     for item in request.moves]
+        if len(set(game_keys)) < len(game_keys):
+            raise endpoints.BadRequestException(
+                'Only one move per game per batch!')
+        names = list(set(item.player_name for item in request.moves))
+        players = dict(zip(names, Player.get_players_by_name(names)))
+        games = ndb.get_multi(game_keys)
+
+        # Moves that cannot end their game only write the game itself and
+        # are applied together, MAX_BATCH_GROUPS games per transaction. The
+        # others also write the Score, counters and active games of the
+        # players, and get a transaction each like make_move.
+        results = {}
+        batched, single = [], []
+        for game_key, game, item in zip(game_keys, games, request.moves):
+            move = (game_key, players[item.player_name], item.move)
+            if game and not self._may_end_game(game, *move[1:]):
+                batched.append(move)
+            else:
+                single.append(move)
+        for start in range(0, len(batched), MAX_BATCH_GROUPS):
+            chunk = batched[start:start + MAX_BATCH_GROUPS]
+            try:
+                results.update(self._make_moves(chunk))
+            except _GameEnded:
+                # A game changed since it was read: apply one by one
+                single.extend(chunk)
+        for game_key, player, move in single:
+            try:
+                results[game_key] = self._make_move(game_key, player, move)
+            except endpoints.ServiceException as e:
+                results[game_key] = str(e)
+
+        player_keys = set()
+        for result in results.values():
+            if not isinstance(result, basestring):
+                player_keys.update([result[0].host, result[0].oppoent])
+        player_keys = list(player_keys)
+        players = dict(zip(player_keys, ndb.get_multi(player_keys)))
+        forms = []
+        for game_key, item in zip(game_keys, request.moves):
+            result = results[game_key]
+            form = MoveResultForm(urlsafe_game_key=item.urlsafe_game_key)
+            if isinstance(result, basestring):
+                form.error = result
+            else:
+                game, msg = result
+                form.game = game.to_form(msg, players)
+            forms.append(form)
+        return MoveResultForms(items=forms)
+
+    @staticmethod
+    def _may_end_game(game, player, move):
+        """Check if the move, or the AI's reply to it, could end the game"""
+        if not player or not game.check_player(player) or \
+                not game.is_available(move):
+            return False
+        if game.is_host(player):
+            mover, other = game.host_board, game.oppoent_board
+        else:
+            mover, other = game.oppoent_board, game.host_board
+        mover |= engine.bit(move)
+        if engine.is_winner(mover) or engine.is_full(mover, other):
+            return True
+        # The AI needs three marks to win, and has at least two when its
+        # reply fills the board
+        return bool(game.ai_level) and bin(other).count('1') >= 2
 
-    @endpoints.method(response_message=UserForms,
+    @ndb.transactional(xg=True)
+    def _make_moves(self, moves):
+        """Applies moves that do not end their games, each in a different
+        game, in one transaction with a single get_multi and put_multi.
+        Returns a dictionary of game key to (game, message) or error. Raises
+        _GameEnded if a move could end its game"""
+        games = ndb.get_multi([game_key for game_key, _, _ in moves])
+        results = {}
+        entities = []
+        notifications = {}
+        for game, (game_key, player, move) in zip(games, moves):
+            # Checked on the game read in the transaction, before end_game
+            # would read more entity groups than the transaction can hold
+            if game and self._may_end_game(game, player, move):
+                raise _GameEnded()
+            try:
+                game_entities, _, game_notifications, msg = \
+                    self._apply_move(game, player, move)
+            except endpoints.ServiceException as e:
+                results[game_key] = str(e)
+                continue
+            entities.extend(game_entities)
+            notifications[game.key] = game_notifications
+            results[game.key] = game, msg
+        ndb.put_multi(entities + outbox.post_multi(notifications))
+        return results
+
+    @endpoints.method(request_message=RANKINGS_REQUEST,
+                      response_message=UserForms,
                       path='rankings',
                       name='get_player_rankings',
                       http_method='GET')
+    @profiling.profiled
     def get_player_rankings(self, request):
-        """Return a list of players ranked"""
-        players.query(Player.played > 0).fetch()
-        players = sorted(players, key=lambda x: x.get_win_rate, reverse=True)
-        return UserForms(items=[player.to_form() for player in players])
+        """Return a page of players ranked by win rate, read from the
+        leaderboard. Pass next_cursor to get the next page"""
+        limit = min(request.limit or DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE)
+        cursor = get_cursor_by_urlsafe(request.cursor)
+        entries, next_cursor = leaderboard.get_page(limit, cursor)
+        return UserForms(items=[entry.to_form() for entry in entries],
+                         next_cursor=next_cursor and next_cursor.urlsafe())
 
     @endpoints.method(request_message=PLAYER_REQUEST,
+                      response_message=RankForm,
+                      path='rankings/player/{player_name}',
+                      name='get_player_rank',
+                      http_method='GET')
+    @profiling.profiled
+    def get_player_rank(self, request):
+        """Return the rank of a player on the leaderboard"""
+        player = Player.get_player_by_name(request.player_name)
+        if not player:
+            raise endpoints.NotFoundException(
+                    'A Player with that name does not exist!')
+        rank = leaderboard.get_rank(player.key)
+        if not rank:
+            raise endpoints.NotFoundException(
+                    'This Player has not completed a game yet!')
+        entry, position, ranked_players = rank
+        return RankForm(player=entry.to_form(), rank=position,
+                        ranked_players=ranked_players)
+
+    @endpoints.method(request_message=SCORES_REQUEST,
                       response_message=ScoreForms,
                       path='scores/player/{player_name}',
                       name='get_player_scores',
                       http_method='GET')
+    @profiling.profiled
     def get_player_scores(self, request):
-        """Returns all of an individual Player's scores"""
+        """Returns a page of an individual Player's scores. Pass next_cursor
+        to get the next page"""
         player = Player.get_player_by_name(request.player_name)
         if not player:
             raise endpoints.NotFoundException(
                     'A Player with that name does not exist!')
-        scores = Score.query(
-            ndb.OR(Score.host == player.key),
-            (Score.oppoent == player.key)).fetch()
-        return ScoreForms(items=[score.to_form() for score in scores])
+        limit = min(request.limit or DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE)
+        cursor = get_cursor_by_urlsafe(request.cursor)
+        scores, next_cursor, more = Score.query(
+            ndb.OR(Score.host == player.key,
+                   Score.oppoent == player.key)).order(Score.key).fetch_page(
+            limit, start_cursor=cursor)
+        # The player's own name is known already
+        names = {player.key: player.name}
+        return ScoreForms(items=Score.to_forms(scores, names),
+                          next_cursor=next_cursor.urlsafe() if more else None)
 
     @endpoints.method(request_message=GET_GAME_REQUEST,
                       response_message=StringMessage,
                       path='game/{urlsafe_game_key}/history',
                       name='get_game_history',
                       http_method='GET')
+    @profiling.profiled
     def get_game_history(self, request):
-        """Return game history."""
+        """Return game history. The moves of an archived game are read from
+        its Score"""
         game = get_by_urlsafe(request.urlsafe_game_key, Game)
-        if not game:
+        if game:
+            return StringMessage(message=str(game.get_history()))
+        score = Score.key_for(get_key_by_urlsafe(request.urlsafe_game_key,
+                                                 Game)).get()
+        if not score or not score.archived:
             raise endpoints.NotFoundException('Game not found')
-        return StringMessage(message=str(game.history))
+        return StringMessage(message=str(score.get_history()))
+
+    @endpoints.method(request_message=PLAYER_REQUEST,
+                      response_message=StringMessage,
+                      path='matchmaking/{player_name}',
+                      name='join_matchmaking',
+                      http_method='POST')
+    @profiling.profiled
+    def join_matchmaking(self, request):
+        """Wait for a game against a player of a similar rating. The game
+        shows up in list_my_games once paired"""
+        player = Player.get_player_by_name(request.player_name)
+        if not player:
+            raise endpoints.NotFoundException(
+                    'A Player with that name does not exist!')
+        matchmaking.join(player.key)
+        return StringMessage(message='Looking for an oppoent...')
+
+    @endpoints.method(request_message=PLAYER_REQUEST,
+                      response_message=StringMessage,
+                      path='matchmaking/{player_name}',
+                      name='leave_matchmaking',
+                      http_method='DELETE')
+    @profiling.profiled
+    def leave_matchmaking(self, request):
+        """Stop waiting for a game"""
+        player = Player.get_player_by_name(request.player_name)
+        if not player:
+            raise endpoints.NotFoundException(
+                    'A Player with that name does not exist!')
+        matchmaking.leave(player.key)
+        return StringMessage(message='You have left the queue.')
+
+    @endpoints.method(request_message=NewTournamentForm,
+                      response_message=TournamentForm,
+                      path='tournament',
+                      name='create_tournament',
+                      http_method='POST')
+    @profiling.profiled
+    def create_tournament(self, request):
+        """Creates a round-robin or single-elimination tournament between
+        the players. The games of each round are created by a task"""
+        if request.format not in tournament.FORMATS:
+            raise endpoints.BadRequestException(
+                'Please choose a format: round_robin or single_elimination.')
+        names = request.player_names
+        if not 2 <= len(names) <= tournament.MAX_PLAYERS:
+            raise endpoints.BadRequestException(
+                'A tournament needs 2 to {} players!'.format(
+                    tournament.MAX_PLAYERS))
+        if len(set(names)) < len(names):
+            raise endpoints.BadRequestException(
+                'Each player can only enter once!')
+        players = Player.get_players_by_name(names)
+        missing = [name for name, player in zip(names, players) if not player]
+        if missing:
+            raise endpoints.NotFoundException(
+                'Players not found: {}'.format(', '.join(missing[:10])))
+        return tournament.Tournament.create(
+            request.name, request.format,
+            [player.key for player in players]).to_form()
+
+    @endpoints.method(request_message=TOURNAMENT_REQUEST,
+                      response_message=TournamentForm,
+                      path='tournament/{urlsafe_tournament_key}',
+                      name='get_tournament',
+                      http_method='GET')
+    @profiling.profiled
+    def get_tournament(self, request):
+        """Return the current tournament state"""
+        entity = get_by_urlsafe(request.urlsafe_tournament_key,
+                                tournament.Tournament)
+        if not entity:
+            raise endpoints.NotFoundException('Tournament not found!')
+        return entity.to_form()
+
+    @endpoints.method(request_message=RANKINGS_REQUEST,
+                      response_message=ExportForm,
+                      path='games/export',
+                      name='export_games',
+                      http_method='GET')
+    @profiling.profiled
+    def export_games(self, request):
+        """Return a page of completed games as newline-delimited JSON
+        records. Pass next_cursor to get the next page"""
+        limit = min(request.limit or MAX_EXPORT_PAGE_SIZE,
+                    MAX_EXPORT_PAGE_SIZE)
+        cursor = get_cursor_by_urlsafe(request.cursor)
+        records, next_cursor = export.get_page(limit, cursor)
+        return ExportForm(records=export.to_lines(records),
+                          count=len(records),
+                          next_cursor=next_cursor.urlsafe()
+                          if next_cursor else None)
+
+    @endpoints.method(request_message=POSITION_REQUEST,
+                      response_message=PositionStatsForm,
+                      path='positions/stats',
+                      name='get_position_stats',
+                      http_method='GET')
+    @profiling.profiled
+    def get_position_stats(self, request):
+        """Return the outcomes of the completed games that went through a
+        position and the win rate of the player to move. The position is
+        the current one of urlsafe_game_key, or the one reached by moves, the
+        positions played as digits from the first player's move on"""
+        if request.urlsafe_game_key:
+            game = get_by_urlsafe(request.urlsafe_game_key, Game)
+            if not game:
+                raise endpoints.NotFoundException('Game not found!')
+            position = game.position
+        else:
+            boards = [0, 0]
+            for ply, move in enumerate(request.moves or ''):
+                if not move.isdigit() or engine.is_winner(boards[1 - ply % 2]) \
+                        or not engine.is_legal(boards[0], boards[1], int(move)):
+                    raise endpoints.BadRequestException(
+                        'This position cannot be reached in a game!')
+                boards[ply % 2] |= engine.bit(int(move))
+            position = symmetry.canonical(boards[0], boards[1])[0]
+        first_wins, second_wins, draws = stats.get_position_stats(position)
+        next_turn = stats.mover(position)
+        games = first_wins + second_wins + draws
+        won = first_wins if next_turn == stats.FIRST else second_wins
+        return PositionStatsForm(position=position,
+                                 next_turn=next_turn,
+                                 games=games,
+                                 first_player_wins=first_wins,
+                                 second_player_wins=second_wins,
+                                 draws=draws,
+                                 win_rate=Player.win_rate(won, games))
+
+    @endpoints.method(request_message=PLAYER_REQUEST,
+                      response_message=OpeningProfileForm,
+                      path='player/{player_name}/openings',
+                      name='get_opening_profile',
+                      http_method='GET')
+    @profiling.profiled
+    def get_opening_profile(self, request):
+        """Return the results of a player per opening, as the first and the
+        second player"""
+        player = Player.get_player_by_name(request.player_name)
+        if not player:
+            raise endpoints.NotFoundException(
+                    'A Player with that name does not exist!')
+        profile = stats.OpeningProfile.key_for(player.key).get()
+        openings = []
+        for opening, sides in sorted(profile and profile.openings and
+                                     profile.openings.items() or []):
+            first_board, _ = engine.decode(int(opening))
+            for side in (stats.FIRST, stats.SECOND):
+                if side in sides:
+                    won, tied, lost = sides[side]
+                    openings.append(OpeningStatsForm(
+                        position=engine.POSITIONS[first_board][0],
+                        side=side, won=won, tied=tied, lost=lost))
+        return OpeningProfileForm(player_name=player.name, openings=openings)
+
+    @endpoints.method(response_message=CacheStatsForm,
+                      path='admin/cache',
+                      name='get_cache_stats',
+                      http_method='GET')
+    @profiling.profiled
+    def get_cache_stats(self, request):
+        """Return the hit and miss counts of the game cache. Administrators
+        only"""
+        _check_admin()
+        return CacheStatsForm(**cache.get_stats())
+
+    @endpoints.method(response_message=ProfileForms,
+                      path='admin/profile',
+                      name='get_profile',
+                      http_method='GET')
+    @profiling.profiled
+    def get_profile(self, request):
+        """Return the latency and RPC histograms of the sampled endpoint and
+        handler calls served by this instance, see profiling.py.
+        Administrators only"""
+        _check_admin()
+        return self._profile_forms(profiling.get_forms())
+
+    @endpoints.method(response_message=ProfileForms,
+                      path='admin/profile/reset',
+                      name='reset_profile',
+                      http_method='POST')
+    @profiling.profiled
+    def reset_profile(self, request):
+        """Drop the profiles of this instance to start over, returning them.
+        Administrators only"""
+        _check_admin()
+        items = profiling.get_forms()
+        profiling.reset()
+        return self._profile_forms(items)
+
+    def _profile_forms(self, items):
+        return ProfileForms(instance=os.environ.get('INSTANCE_ID'),
+                            sample_rate=profiling.SAMPLE_RATE,
+                            latency_bounds_ms=profiling.LATENCY_BOUNDS_MS,
+                            payload_bounds=profiling.PAYLOAD_BOUNDS,
+                            items=items)
 
 api = endpoints.api_server([TicTacToeApi])
@@ -0,0 +1,94 @@
+"""archive.py - Compaction of the old completed games.
+
+Once a game has been over for ARCHIVE_AFTER_DAYS (an environment variable set
+in app.yaml), its packed moves are copied into its Score and the Game is
+deleted, along with its index entries. The Score is a child of the Game, so it
+keeps its key, and the copy and the delete are one single-group transaction.
+get_game_history and the export read the moves of an archived game from the
+Score.
+
+A daily cron starts a chain of tasks paging through the Scores by end_date,
+from where the previous run stopped to the cutoff. Each task archives a page
+of games, BATCH_SIZE transactions running concurrently. Games not yet added to
+the position statistics (see stats.py) are kept, and the next run starts over
+from the first of them."""
+
+import os
+from datetime import datetime, timedelta
+
+from google.appengine.api import taskqueue
+from google.appengine.ext import ndb
+
+from models import GameState, Score
+import stats
+
+ARCHIVE_AFTER_DAYS = int(os.environ.get('ARCHIVE_AFTER_DAYS', 30))
+WORKER_URL = '/tasks/archive_games'
+BATCH_SIZE = 100
+DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+
+class ArchiveState(ndb.Model):
+    """End date of the completed games archived so far"""
+    archived_until = ndb.DateTimeProperty(indexed=False)
+
+    @classmethod
+    def get_state(cls):
+        return cls.get_or_insert('archive')
+
+
+def start():
+    """Enqueues the first task of a run, archiving the games that ended
+    before the cutoff"""
+    cutoff = datetime.now() - timedelta(days=ARCHIVE_AFTER_DAYS)
+    taskqueue.add(url=WORKER_URL,
+                  params={'cutoff': cutoff.strftime(DATE_FORMAT)})
+
+
+def parse_date(value):
+    return datetime.strptime(value, DATE_FORMAT) if value else None
+
+
+@ndb.transactional_tasklet
+def _archive_async(game_key):
+    """Copies the moves of a completed game into its Score and deletes the
+    Game. Returns False if the game is gone already"""
+    game, score = yield ndb.get_multi_async([game_key,
+                                             Score.key_for(game_key)])
+    if not game or not score or game.status != GameState.Completed:
+        raise ndb.Return(False)
+    if game.has_legacy_properties():
+        game.migrate()
+    score.moves = game.moves
+    yield score.put_async(), game_key.delete_async()
+    raise ndb.Return(True)
+
+
+def archive_page(cutoff, cursor=None):
+    """Archives a page of the games that ended before the cutoff, since the
+    end of the previous run. Returns the number of games archived, the end
+    date of the first game kept, or None, and the cursor of the next page, or
+    None if there is none"""
+    query = Score.query(Score.end_date < cutoff)
+    since = ArchiveState.get_state().archived_until
+    if since:
+        query = query.filter(Score.end_date >= since)
+    scores, next_cursor, more = query.order(Score.end_date).fetch_page(
+        BATCH_SIZE, start_cursor=cursor)
+    scores = [score for score in scores if not score.archived]
+    markers = ndb.get_multi([stats.Aggregated.key_for(score.game)
+                             for score in scores])
+    kept = [score.end_date for score, marker in zip(scores, markers)
+            if not marker]
+    futures = [_archive_async(score.game)
+               for score, marker in zip(scores, markers) if marker]
+    archived = sum(future.get_result() for future in futures)
+    return archived, min(kept) if kept else None, \
+        next_cursor if more else None
+
+
+def finish(archived_until):
+    """Records where the next run starts from"""
+    state = ArchiveState.get_state()
+    state.archived_until = archived_until
+    state.put()
@@ -0,0 +1,2 @@
+"""Offline benchmarks. Run them from the project root, e.g.
+python -m benchmarks.ai_latency"""
@@ -0,0 +1,76 @@
+"""ai_latency.py - Measures how long the AI takes to choose a move, with an
+empty (cold) and a populated (warm) transposition table.
+
+    python -m benchmarks.ai_latency [--level hard] [--positions 2000]
+"""
+
+import argparse
+import random
+import sys
+import timeit
+
+import ai
+import engine
+
+
+def random_positions(count, seed=0):
+    """Returns (mover, other) bitboards of positions where it is the AI's
+    turn and the game is not over"""
+    rng = random.Random(seed)
+    positions = []
+    while len(positions) < count:
+        boards = [0, 0]
+        plies = rng.randint(0, 8)
+        for ply in range(plies):
+            side = ply % 2
+            boards[side] |= engine.bit(rng.choice(
+                engine.legal_moves(boards[0], boards[1])))
+            if engine.is_winner(boards[side]):
+                break
+        else:
+            mover, other = boards[plies % 2], boards[1 - plies % 2]
+            positions.append((mover, other))
+    return positions
+
+
+def measure(positions, level, cold):
+    """Returns the latency of each move in microseconds"""
+    timer = timeit.default_timer
+    latencies = []
+    for mover, other in positions:
+        if cold:
+            ai.transposition_table.clear()
+        start = timer()
+        ai.choose_move(mover, other, level)
+        latencies.append((timer() - start) * 1e6)
+    return latencies
+
+
+def report(name, latencies):
+    latencies = sorted(latencies)
+    count = len(latencies)
+    sys.stdout.write('{:<5} p50 {:>9.1f}us  p99 {:>9.1f}us  max {:>9.1f}us\n'
+                     .format(name, latencies[count // 2],
+                             latencies[min(count - 1, count * 99 // 100)],
+                             latencies[-1]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--level', default=ai.HARD, choices=sorted(ai.LEVELS))
+    parser.add_argument('--positions', type=int, default=2000)
+    args = parser.parse_args()
+
+    positions = random_positions(args.positions)
+    report('cold', measure(positions, args.level, cold=True))
+    ai.transposition_table.clear()
+    measure(positions, args.level, cold=False)
+    report('warm', measure(positions, args.level, cold=False))
+    sys.stdout.write('table entries {}, hit rate {:.1%}\n'.format(
+        len(ai.transposition_table),
+        float(ai.transposition_table.hits) /
+        max(1, ai.transposition_table.hits + ai.transposition_table.misses)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,288 @@
+"""api_hotpaths.py - Latency, throughput and RPC counts of the API hot paths
+and the main.py handlers, against the App Engine testbed stubs.
+
+For each data size the Datastore is seeded with that many players (with their
+name and email reservations and leaderboard entries) and games, then every
+operation is called --calls times:
+
+    create_player, new_game, make_move (against a player and the AI),
+    get_game, get_player_rankings, the reminder cron and worker, the outbox
+    drain, the leaderboard update and forfeit_game
+
+Reported are the p50 and p99 wall time, the throughput and the number of RPCs
+per call for each API method called (datastore_v3.Get, memcache.Get, ...),
+counted by an apiproxy pre-call hook. RPC counts do not depend on the stubs,
+so a change adding a Datastore round trip to a hot path shows up here before
+deploy. Needs the App Engine SDK: pass its directory with --sdk unless
+dev_appserver is importable already.
+
+    python -m benchmarks.api_hotpaths [--sizes 1000 10000] [--calls 200]
+        [--sdk ~/google-cloud-sdk/platform/google_appengine]
+
+Seeding the in-memory Datastore stub dominates the run time at large sizes, so
+sizes of 1M are best run on their own.
+"""
+
+import argparse
+import collections
+import os
+import random
+import sys
+import timeit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PUT_BATCH = 500
+
+
+def setup_sdk(sdk):
+    """Puts the SDK and its bundled libraries on sys.path"""
+    if sdk:
+        sys.path.insert(0, os.path.expanduser(sdk))
+    import dev_appserver
+    dev_appserver.fix_sys_path()
+
+
+class RpcCounter(object):
+    """Counts the RPCs made, by service and method"""
+
+    def __init__(self):
+        self.counts = collections.Counter()
+
+    def count(self, service, call, request, response):
+        self.counts['{}.{}'.format(service, call)] += 1
+
+    def install(self):
+        # Hooks must be functions or methods, the API proxy inspects their
+        # arguments
+        from google.appengine.api import apiproxy_stub_map
+        apiproxy_stub_map.apiproxy.GetPreCallHooks().Append(
+            'rpc_counter', self.count)
+
+
+def start_testbed():
+    """Activates the stubs the API and handlers use"""
+    from google.appengine.datastore import datastore_stub_util
+    from google.appengine.ext import ndb
+    from google.appengine.ext import testbed
+
+    bed = testbed.Testbed()
+    bed.activate()
+    # endpoints.api_server reads the app revision from the version ID
+    bed.setup_env(current_version_id='1.1', overwrite=True)
+    bed.init_datastore_v3_stub(
+        consistency_policy=datastore_stub_util.PseudoRandomHRConsistencyPolicy(
+            probability=1))
+    bed.init_memcache_stub()
+    bed.init_taskqueue_stub(root_path=ROOT)
+    bed.init_mail_stub()
+    bed.init_app_identity_stub()
+    bed.init_urlfetch_stub()
+    ndb.get_context().clear_cache()
+    return bed
+
+
+def put_in_batches(entities):
+    from google.appengine.ext import ndb
+    for start in range(0, len(entities), PUT_BATCH):
+        ndb.put_multi(entities[start:start + PUT_BATCH])
+
+
+def seed(size, rng):
+    """Writes size players, size // 2 games between them and size // 2
+    games against the AI, which has played the center. Returns the keys of
+    both kinds of games"""
+    from google.appengine.ext import ndb
+    import codec
+    import engine
+    import leaderboard
+    from models import Player, PlayerName, PlayerEmail, Game, ActiveGames
+
+    entities = []
+    for index in range(size):
+        key = ndb.Key(Player, index + 1)
+        name, email = 'player{}'.format(index), 'player{}@example.com'.format(
+            index)
+        played = rng.randint(1, 50)
+        won = rng.randint(0, played)
+        win_rate = Player.win_rate(won, played)
+        entities.extend([
+            Player(key=key, name=name, email=email),
+            PlayerName(key=PlayerName.key_for(name), player=key),
+            PlayerEmail(key=PlayerEmail.key_for(email), player=key),
+            leaderboard.LeaderboardEntry(
+                key=leaderboard.LeaderboardEntry.key_for(key), player=key,
+                name=name, email=email, won=won, played=played,
+                win_rate=win_rate, bucket=leaderboard._bucket(win_rate))])
+    put_in_batches(entities)
+
+    ai_key = Player.get_ai_player('easy').key
+    entities = []
+    game_keys, ai_game_keys = [], []
+    for index in range(size // 2):
+        host, oppoent = ndb.Key(Player, 2 * index + 1), ndb.Key(
+            Player, 2 * index + 2)
+        game = Game(id=index + 1, host=host, oppoent=oppoent,
+                    next_turn=oppoent)
+        ai_game = Game(id=size + index + 1, host=host, oppoent=ai_key,
+                       next_turn=host, ai_level='easy',
+                       oppoent_board=engine.bit(5),
+                       moves=codec.encode([(codec.OPPOENT, 5)]))
+        game_keys.append(game.key)
+        ai_game_keys.append(ai_game.key)
+        entities.extend([
+            game,
+            ai_game,
+            ActiveGames(key=ActiveGames.key_for(host),
+                        games=[game.key, ai_game.key],
+                        oppoents=[oppoent, ai_key]),
+            ActiveGames(key=ActiveGames.key_for(oppoent), games=[game.key],
+                        oppoents=[host])])
+    put_in_batches(entities)
+    return game_keys, ai_game_keys
+
+
+def operations(size, game_keys, ai_game_keys):
+    """Returns the (name, function of the call number) of the operations"""
+    import webapp2
+    from google.appengine.ext import ndb
+    import api
+    import main
+    from models import Player
+
+    service = api.TicTacToeApi()
+
+    def request(container, **fields):
+        return container.combined_message_class(**fields)
+
+    def handler(url, method='POST', **params):
+        response = webapp2.Request.blank(
+            url, POST=params if method == 'POST' else None).get_response(
+                main.app)
+        assert response.status_int == 200, (url, response.status)
+
+    def create_player(call):
+        service.create_player(request(
+            api.NEW_PLAYER_REQUEST, player_name='new{}'.format(call),
+            email='new{}@example.com'.format(call)))
+
+    def new_game(call):
+        # Players 2i and 2i + 3 have no game together yet
+        service.new_game(request(
+            api.NEW_GAME_REQUEST, host_name='player{}'.format(2 * call),
+            oppoent_name='player{}'.format((2 * call + 3) % size)))
+
+    def make_move(call):
+        # The oppoent of each seeded game moves first
+        service.make_move(request(
+            api.MAKE_MOVE_REQUEST,
+            urlsafe_game_key=game_keys[call].urlsafe(),
+            player_name='player{}'.format(2 * call + 1), move=5))
+
+    def make_move_ai(call):
+        # The AI of each seeded single-player game has played the center
+        service.make_move(request(
+            api.MAKE_MOVE_REQUEST,
+            urlsafe_game_key=ai_game_keys[call].urlsafe(),
+            player_name='player{}'.format(2 * call), move=1))
+
+    def get_game(call):
+        service.get_game(request(
+            api.GET_GAME_REQUEST,
+            urlsafe_game_key=game_keys[call].urlsafe()))
+
+    def get_player_rankings(call):
+        service.get_player_rankings(request(api.RANKINGS_REQUEST, limit=20))
+
+    def send_reminder_cron(call):
+        handler('/crons/send_reminder', method='GET')
+
+    def send_reminders(call):
+        handler('/tasks/send_reminders', cursor='')
+
+    def drain_outbox(call):
+        # make_move posted a notification for the host of the game
+        handler('/tasks/drain_outbox', game_key=game_keys[call].urlsafe())
+
+    def update_leaderboard(call):
+        handler('/tasks/update_leaderboard',
+                user_key=ndb.Key(Player, 2 * call + 1).urlsafe())
+
+    def forfeit_game(call):
+        service.forfeit_game(request(
+            api.FORFEIT_REQUEST,
+            urlsafe_game_key=game_keys[call].urlsafe(),
+            player_name='player{}'.format(2 * call)))
+
+    return [('create_player', create_player),
+            ('new_game', new_game),
+            ('make_move', make_move),
+            ('make_move vs AI', make_move_ai),
+            ('get_game', get_game),
+            ('get_player_rankings', get_player_rankings),
+            ('cron send_reminder', send_reminder_cron),
+            ('task send_reminders', send_reminders),
+            ('task drain_outbox', drain_outbox),
+            ('task update_leaderboard', update_leaderboard),
+            ('forfeit_game', forfeit_game)]
+
+
+def measure(function, calls, counter):
+    """Returns the latency of each call in seconds and the RPC counts of all
+    the calls"""
+    from google.appengine.ext import ndb
+    timer = timeit.default_timer
+    latencies = []
+    counter.counts.clear()
+    for call in range(calls):
+        # Each call is a new request with an empty context cache
+        ndb.get_context().clear_cache()
+        start = timer()
+        function(call)
+        latencies.append(timer() - start)
+    return latencies, dict(counter.counts)
+
+
+def report(name, latencies, counts, calls):
+    latencies.sort()
+    count = len(latencies)
+    rpcs = ', '.join('{} {:.1f}'.format(method, total / float(calls))
+                     for method, total in sorted(counts.items()))
+    sys.stdout.write(
+        '  {:<26} p50 {:7.2f}ms  p99 {:7.2f}ms  {:7.0f} calls/s  {}\n'.format(
+            name, latencies[count // 2] * 1000,
+            latencies[min(count - 1, count * 99 // 100)] * 1000,
+            count / sum(latencies), rpcs))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000],
+                        help='numbers of players to seed, as many games')
+    parser.add_argument('--calls', type=int, default=200)
+    parser.add_argument('--sdk', help='App Engine SDK directory')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    setup_sdk(args.sdk)
+    for size in args.sizes:
+        calls = min(args.calls, size // 2)
+        bed = start_testbed()
+        counter = RpcCounter()
+        try:
+            started = timeit.default_timer()
+            game_keys, ai_game_keys = seed(size, random.Random(args.seed))
+            sys.stdout.write('{} players, {} games (seeded in {:.1f}s), {} '
+                             'calls per operation, RPCs per call:\n'.format(
+                                 size, len(game_keys) + len(ai_game_keys),
+                                 timeit.default_timer() - started, calls))
+            counter.install()
+            for name, function in operations(size, game_keys,
+                                             ai_game_keys):
+                latencies, counts = measure(function, calls, counter)
+                report(name, latencies, counts, calls)
+        finally:
+            bed.deactivate()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+"""game_encoding.py - Compares the packed moves of codec.py with the legacy
+layout of four pickled lists (setup, host_moves, oppoent_moves and history
+of [player_name, move] pairs), for entity size and decode time.
+
+Sizes are those of the property values stored on the entity: the pickles
+(protocol 2, as written by ndb.PickleProperty) against the moves blob plus
+the two board integers.
+
+    python -m benchmarks.game_encoding [--games 10000] [--repeat 5]
+"""
+
+import argparse
+import random
+import sys
+import timeit
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+import codec
+import engine
+
+NAMES = (u'oppoent player', u'host player')
+
+
+def random_games(count, seed=0):
+    """Returns the plies of random games played to the end"""
+    rng = random.Random(seed)
+    games = []
+    for _ in range(count):
+        boards = [0, 0]
+        plies = []
+        while not engine.is_full(boards[0], boards[1]):
+            side = len(plies) % 2
+            move = rng.choice(engine.legal_moves(boards[0], boards[1]))
+            boards[side] |= engine.bit(move)
+            plies.append((codec.HOST if side else codec.OPPOENT, move))
+            if engine.is_winner(boards[side]):
+                break
+        games.append(plies)
+    return games
+
+
+def legacy_values(plies):
+    """Returns the pickled setup, host_moves, oppoent_moves and history"""
+    host_moves = [move for side, move in plies if side == codec.HOST]
+    oppoent_moves = [move for side, move in plies if side == codec.OPPOENT]
+    setup = [move for move in range(1, 10)
+             if move not in host_moves and move not in oppoent_moves]
+    history = [[NAMES[side], move] for side, move in plies]
+    return [pickle.dumps(value, 2)
+            for value in (setup, host_moves, oppoent_moves, history)]
+
+
+def varint_size(value):
+    """Returns the size of an integer property value"""
+    size = 1
+    while value >= 0x80:
+        value >>= 7
+        size += 1
+    return size
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--games', type=int, default=10000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    games = random_games(args.games)
+    legacy = [legacy_values(plies) for plies in games]
+    packed = [codec.encode(plies) for plies in games]
+    boards = [codec.boards(data) for data in packed]
+
+    legacy_size = sum(len(value) for values in legacy for value in values)
+    packed_size = sum(len(data) + varint_size(host) + varint_size(oppoent)
+                      for data, (host, oppoent) in zip(packed, boards))
+
+    def decode_legacy():
+        for values in legacy:
+            for value in values:
+                pickle.loads(value)
+
+    def decode_packed():
+        for data in packed:
+            codec.decode(data)
+
+    legacy_time = min(timeit.repeat(decode_legacy, number=1,
+                                    repeat=args.repeat))
+    packed_time = min(timeit.repeat(decode_packed, number=1,
+                                    repeat=args.repeat))
+    sys.stdout.write(
+        '{} games, {:.1f} plies on average\n'
+        'pickled lists  {:6.1f} bytes/game  decode {:6.2f}us/game\n'
+        'packed moves   {:6.1f} bytes/game  decode {:6.2f}us/game\n'
+        '{:.1f}x smaller, {:.1f}x faster to decode\n'.format(
+            args.games, sum(len(plies) for plies in games) / float(args.games),
+            legacy_size / float(args.games),
+            legacy_time * 1e6 / args.games,
+            packed_size / float(args.games),
+            packed_time * 1e6 / args.games,
+            legacy_size / float(packed_size), legacy_time / packed_time))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+"""long_poll.py - Simulates thousands of clients waiting for their turn with
+longpoll.poll against in-memory version counters.
+
+Each waiter thread holds a poll on one game and re-polls each time the game
+changes. A mover thread bumps the version of every game once per round, the
+way make_move does through cache.py. Reported are the wake-up latency after a
+move and the number of counter reads, compared with the get_game requests
+the same clients would make polling once per poll-interval.
+
+    python -m benchmarks.long_poll [--waiters 2000] [--games 1000]
+"""
+
+import argparse
+import sys
+import threading
+import timeit
+
+import longpoll
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--waiters', type=int, default=2000)
+    parser.add_argument('--games', type=int, default=1000)
+    parser.add_argument('--rounds', type=int, default=3)
+    parser.add_argument('--move-interval', type=float, default=10.0,
+                        help='seconds between two moves of a game')
+    parser.add_argument('--poll-interval', type=float, default=1.0,
+                        help='seconds between get_game calls of a client '
+                             'polling without wait_for_turn')
+    args = parser.parse_args()
+
+    clock = timeit.default_timer
+    versions = longpoll.InMemoryVersions()
+    moved_at = {}
+    latencies = []
+    waiting = [0.0]
+    lock = threading.Lock()
+
+    def wait(game):
+        known = 0
+        while known < args.rounds:
+            start = clock()
+            version = longpoll.poll(versions.get, game, known, clock=clock)
+            now = clock()
+            with lock:
+                waiting[0] += now - start
+                if version != known:
+                    latencies.append(now - moved_at[game, version])
+            known = version
+
+    def move():
+        for _ in range(args.rounds):
+            start = clock()
+            for game in range(args.games):
+                with lock:
+                    moved_at[game, versions.get(game) + 1] = clock()
+                    versions.bump(game)
+            elapsed = clock() - start
+            if elapsed < args.move_interval:
+                threading.Event().wait(args.move_interval - elapsed)
+
+    threads = [threading.Thread(target=wait, args=(i % args.games,))
+               for i in range(args.waiters)]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    started = clock()
+    reads_before = versions.reads
+    move()
+    for thread in threads:
+        thread.join()
+    elapsed = clock() - started
+
+    latencies.sort()
+    count = len(latencies)
+    polls = waiting[0] / args.poll_interval
+    sys.stdout.write(
+        '{} waiters on {} games, {} notifications in {:.1f}s\n'
+        'wake-up latency p50 {:.0f}ms p99 {:.0f}ms\n'
+        'counter reads {} vs {:.0f} get_game polls ({:.1f}x fewer '
+        'requests: {} held wait_for_turn calls)\n'.format(
+            args.waiters, args.games, count, elapsed,
+            latencies[count // 2] * 1000,
+            latencies[min(count - 1, count * 99 // 100)] * 1000,
+            versions.reads - reads_before, polls,
+            polls / max(1, args.waiters * args.rounds),
+            args.waiters * args.rounds))
+
+
+if __name__ == '__main__':
+    main()
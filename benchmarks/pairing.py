@@ -0,0 +1,67 @@
+"""pairing.py - Measures the in-memory matchmaking queue of matchqueue.py
+with tens of thousands of waiting players.
+
+Reported are the cost of adding and removing a player, and of a pairing run
+over the whole queue, per pair made, with ratings drawn from a normal
+distribution and players who joined over the last --spread seconds.
+
+    python -m benchmarks.pairing [--players 50000] [--spread 60]
+"""
+
+import argparse
+import random
+import sys
+import timeit
+
+from matchqueue import MatchQueue
+
+
+def fill(players, spread, now, seed=0):
+    """Returns a queue of players with random ratings and join times"""
+    rng = random.Random(seed)
+    queue = MatchQueue()
+    for player in range(players):
+        queue.add(player, rng.gauss(1500, 200), now - rng.random() * spread)
+    return queue
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--players', type=int, default=50000)
+    parser.add_argument('--spread', type=float, default=60.0,
+                        help='seconds over which the players joined')
+    args = parser.parse_args()
+
+    timer = timeit.default_timer
+    now = 1e9
+    start = timer()
+    queue = fill(args.players, args.spread, now)
+    fill_time = timer() - start
+
+    rng = random.Random(1)
+    extra = range(args.players, args.players + 1000)
+    start = timer()
+    for player in extra:
+        queue.add(player, rng.gauss(1500, 200), now)
+    add_time = (timer() - start) / len(extra)
+    start = timer()
+    for player in extra:
+        queue.remove(player)
+    remove_time = (timer() - start) / len(extra)
+
+    start = timer()
+    pairs = queue.pair(now)
+    pair_time = timer() - start
+
+    sys.stdout.write(
+        '{} waiting players loaded in {:.0f}ms\n'
+        'add {:.1f}us  remove {:.1f}us\n'
+        'pairing run {:.0f}ms: {} pairs, {:.1f}us per pair, {} left '
+        'waiting\n'.format(
+            args.players, fill_time * 1000, add_time * 1e6,
+            remove_time * 1e6, pair_time * 1000, len(pairs),
+            pair_time * 1e6 / max(1, len(pairs)), len(queue)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+"""reminder_fanout.py - Throughput of the reminder fan-out with local stand-ins for
+the Datastore, mail and taskqueue.
+
+The players with active games are kept in a list and a cursor is an offset
+into it. The cron step enqueues one task per page of reminders.BATCH_SIZE
+players on a LocalQueue, which then runs the worker tasks on a number of
+threads, each sending its emails through a LocalMailer that waits
+--mail-latency seconds per email like a mail API call would.
+
+    python -m benchmarks.reminder_fanout [--players 20000] [--workers 1 4 16]
+"""
+
+import argparse
+import sys
+import time
+import timeit
+
+import reminders
+
+
+def make_players(count, games_per_player):
+    """Returns (name, email, game keys) of players with active games"""
+    return [('player{}'.format(index), 'player{}@example.com'.format(index),
+             ['game{}-{}'.format(index, game)
+              for game in range(games_per_player)])
+            for index in range(count)]
+
+
+def run(players, workers, mail_latency):
+    """Runs the cron step and the workers. Returns the elapsed time, the
+    number of tasks and emails and the number of queue adds"""
+    queue = reminders.LocalQueue()
+    mailer = reminders.LocalMailer()
+
+    def send_mail(sender, to, subject, body):
+        if mail_latency:
+            time.sleep(mail_latency)
+        mailer(sender, to, subject, body)
+
+    def handler(url, params):
+        start = int(params['cursor'])
+        batch = [reminders.build_reminder(name, email, games)
+                 for name, email, games in
+                 players[start:start + reminders.BATCH_SIZE]]
+        reminders.send_reminders(batch, send_mail, 'noreply@example.com')
+
+    started = timeit.default_timer()
+    tasks = [(reminders.WORKER_URL, {'cursor': str(start)})
+             for start in range(0, len(players), reminders.BATCH_SIZE)]
+    for batch in reminders.chunks(tasks, reminders.MAX_TASKS_PER_ADD):
+        queue.add(batch)
+    adds = queue.adds
+    count = queue.run(handler, workers)
+    return timeit.default_timer() - started, count, len(mailer.sent), adds
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--players', type=int, default=20000)
+    parser.add_argument('--games-per-player', type=int, default=3)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 4, 16])
+    parser.add_argument('--mail-latency', type=float, default=0.0005)
+    args = parser.parse_args()
+
+    players = make_players(args.players, args.games_per_player)
+    for workers in args.workers:
+        elapsed, tasks, sent, adds = run(players, workers, args.mail_latency)
+        sys.stdout.write('{:>3} workers: {} tasks ({} queue adds), {} emails '
+                         'in {:.2f}s, {:.0f} players/s\n'.format(
+                             workers, tasks, adds, sent, elapsed,
+                             sent / elapsed))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+"""round_robin.py - Checks and times the round-robin pairings of tournament.py.
+
+For every number of players up to --players, the pairings of all the rounds
+are checked: every player meets every other player once, plays at most once
+a round and moves first in (n - 1) / 2 games, rounded either way. Then the
+pairing of one round of a tournament of tournament.MAX_PLAYERS is timed.
+Needs the App Engine SDK on the path, see api_hotpaths.py.
+
+    python -m benchmarks.round_robin [--players 64] [--sdk DIR]
+"""
+
+import argparse
+import sys
+import timeit
+
+from benchmarks.api_hotpaths import setup_sdk
+
+
+def check(count, round_robin_pairs):
+    """Returns the problems found in the pairings of count players"""
+    players = range(count)
+    rounds = count - 1 + count % 2
+    met = set()
+    first = dict((player, 0) for player in players)
+    problems = []
+    for number in range(1, rounds + 1):
+        seen = set()
+        for host, oppoent in round_robin_pairs(players, number):
+            if host in seen or oppoent in seen:
+                problems.append('round {}: {} or {} plays twice'.format(
+                    number, host, oppoent))
+            seen.update((host, oppoent))
+            pair = frozenset((host, oppoent))
+            if pair in met:
+                problems.append('round {}: {} meets {} again'.format(
+                    number, host, oppoent))
+            met.add(pair)
+            first[oppoent] += 1
+    if len(met) != count * (count - 1) // 2:
+        problems.append('{} pairs met out of {}'.format(
+            len(met), count * (count - 1) // 2))
+    for player, games in sorted(first.items()):
+        if not (count - 1) // 2 <= games <= count // 2:
+            problems.append('player {} moves first in {} games'.format(
+                player, games))
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--players', type=int, default=64)
+    parser.add_argument('--sdk', help='App Engine SDK directory')
+    args = parser.parse_args()
+
+    setup_sdk(args.sdk)
+    import tournament
+
+    failed = 0
+    for count in range(2, args.players + 1):
+        problems = check(count, tournament.round_robin_pairs)
+        for problem in problems:
+            sys.stdout.write('{} players: {}\n'.format(count, problem))
+        failed += bool(problems)
+    sys.stdout.write('pairings of 2 to {} players: {} failed\n'.format(
+        args.players, failed))
+
+    players = range(tournament.MAX_PLAYERS)
+    seconds = min(timeit.repeat(
+        lambda: tournament.round_robin_pairs(players, 2), number=10,
+        repeat=3)) / 10
+    sys.stdout.write('one round of {} players: {:.2f}ms\n'.format(
+        tournament.MAX_PLAYERS, seconds * 1000))
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,157 @@
+"""cache.py - Memcache read-through / write-through cache for entities.
+
+Every cached entity has a version counter in memcache next to its cached
+copy, which is stored together with the version it was read at. A write
+bumps the counter with an atomic incr before storing the new copy, so any
+copy stored earlier, including one being filled by a concurrent reader, no
+longer matches the counter and is ignored. The counter also tells clients
+whether a game has changed since they last read it.
+
+The version is also kept in the entity, incremented by every put, and the
+counter is never behind it. When memcache evicts the counter, it is seeded
+again from the entity, so it does not restart at 1 and repeat a version a
+client already holds.
+
+Hits and misses are counted per instance and flushed to memcache in batches
+so that all instances' counts can be read by get_stats()."""
+
+import threading
+import time
+
+from google.appengine.api import memcache
+from google.appengine.ext import ndb
+
+NAMESPACE = 'cache'
+STATS_KEYS = ('hits', 'misses')
+FLUSH_INTERVAL = 10
+FLUSH_COUNT = 100
+
+_stats = {'hits': 0, 'misses': 0}
+_last_flush = [time.time()]
+_stats_lock = threading.Lock()
+
+
+def _version_key(key):
+    return 'version:' + key.urlsafe()
+
+
+def _entity_key(key):
+    return 'entity:' + key.urlsafe()
+
+
+def _count(name):
+    """Counts a hit or a miss, flushing the counts to memcache when enough
+    of them or enough time has passed"""
+    with _stats_lock:
+        _stats[name] += 1
+        now = time.time()
+        if sum(_stats.values()) < FLUSH_COUNT and \
+                now - _last_flush[0] < FLUSH_INTERVAL:
+            return
+        offsets = dict((stat, count) for stat, count in _stats.items()
+                       if count)
+        for stat in _stats:
+            _stats[stat] = 0
+        _last_flush[0] = now
+    memcache.offset_multi(offsets, namespace=NAMESPACE, initial_value=0)
+
+
+def _seed_version(key, entity):
+    """Puts the counter back after an eviction, at the version of the
+    entity read from the Datastore. Returns the version"""
+    version = entity.version if entity is not None else 0
+    memcache.add(_version_key(key), version, namespace=NAMESPACE)
+    return version
+
+
+def get_version(key):
+    """Returns the version of the entity, 0 if it does not exist"""
+    version = memcache.get(_version_key(key), namespace=NAMESPACE)
+    if version is None:
+        version = _seed_version(key, key.get(use_cache=False))
+    return version
+
+
+def get(key):
+    """Returns the entity from memcache if the cached copy is current,
+    otherwise reads it from the Datastore and caches it"""
+    return get_with_version(key)[0]
+
+
+def get_with_version(key):
+    """Like get, returns the entity and the version it was read at. The
+    version is read before the entity, so a write made in between gives a
+    newer entity with an older version, never the other way around"""
+    cached = memcache.get_multi([_version_key(key), _entity_key(key)],
+                                namespace=NAMESPACE)
+    version = cached.get(_version_key(key))
+    entry = cached.get(_entity_key(key))
+    if version is not None and entry is not None and entry[0] == version:
+        _count('hits')
+        return entry[1], version
+
+    _count('misses')
+    entity = key.get()
+    if version is None:
+        version = _seed_version(key, entity)
+    if entity is not None:
+        memcache.set(_entity_key(key), (version, entity),
+                     namespace=NAMESPACE)
+    return entity, version
+
+
+def store(entity):
+    """Writes the entity through to memcache after it has been put,
+    invalidating every copy cached before. Returns the new version"""
+    version = memcache.incr(_version_key(entity.key), namespace=NAMESPACE,
+                            initial_value=entity.version - 1)
+    if version is not None and version < entity.version:
+        # A bump was lost: catch up with the entity
+        version = memcache.incr(_version_key(entity.key),
+                                delta=entity.version - version,
+                                namespace=NAMESPACE)
+    if version is not None:
+        memcache.set(_entity_key(entity.key), (version, entity),
+                     namespace=NAMESPACE)
+    return version
+
+
+def invalidate(key):
+    """Invalidates every cached copy of the entity. Returns the new
+    version"""
+    return memcache.incr(_version_key(key), namespace=NAMESPACE,
+                         initial_value=0)
+
+
+def get_stats():
+    """Returns the number of hits and misses counted by all instances"""
+    stats = memcache.get_multi(STATS_KEYS, namespace=NAMESPACE)
+    return dict((stat, stats.get(stat, 0)) for stat in STATS_KEYS)
+
+
+class CachedModel(ndb.Model):
+    """Base class for models read through this cache by get_by_urlsafe.
+    Writes are cached by the put hook, once committed when inside a
+    transaction; ndb's own memcache layer is turned off to avoid caching the
+    entity twice. version counts the puts of the entity."""
+    _use_memcache = False
+
+    version = ndb.IntegerProperty(default=0, indexed=False)
+
+    def _pre_put_hook(self):
+        self.version += 1
+
+    def _post_put_hook(self, future):
+        if future.get_exception():
+            return
+        if ndb.in_transaction():
+            ndb.get_context().call_on_commit(lambda: store(self))
+        else:
+            store(self)
+
+    @classmethod
+    def _post_delete_hook(cls, key, future):
+        if ndb.in_transaction():
+            ndb.get_context().call_on_commit(lambda: invalidate(key))
+        else:
+            invalidate(key)
@@ -0,0 +1,62 @@
+"""codec.py - Compact binary encoding of the moves of a game.
+
+The moves are stored in a single blob: a VERSION byte followed by one byte
+per ply, the side that played it in the high nibble and the position (1-9)
+in the low nibble. A whole game fits in 10 bytes. The blob is only decoded
+when the moves are read, the boards are kept as integers on the Game.
+
+    >>> data = append(append(encode([]), OPPOENT, 5), HOST, 1)
+    >>> decode(data)
+    [(0, 5), (1, 1)]
+"""
+
+import engine
+
+VERSION = 1
+OPPOENT, HOST = 0, 1
+
+
+class CodecError(ValueError):
+    """Raised when a blob is not a valid encoding"""
+
+
+def encode(plies):
+    """Returns the blob of a list of (side, position) plies"""
+    data = bytearray([VERSION])
+    for side, move in plies:
+        data.append(side << 4 | move)
+    return bytes(data)
+
+
+EMPTY = encode([])
+
+
+def append(data, side, move):
+    """Returns the blob with one more ply"""
+    return (data or EMPTY) + bytes(bytearray([side << 4 | move]))
+
+
+def decode(data):
+    """Returns the list of (side, position) plies of a blob. An empty blob
+    has no plies"""
+    data = bytearray(data or EMPTY)
+    if data[0] != VERSION:
+        raise CodecError('Unknown encoding version: {}'.format(data[0]))
+    plies = [(byte >> 4, byte & 0x0F) for byte in data[1:]]
+    for side, move in plies:
+        if side not in (OPPOENT, HOST) or not 1 <= move <= 9:
+            raise CodecError('Invalid ply: {}, {}'.format(side, move))
+    return plies
+
+
+def count(data):
+    """Returns the number of plies of a blob without decoding it"""
+    return max(0, len(data or EMPTY) - 1)
+
+
+def boards(data):
+    """Returns the (host_board, oppoent_board) of a blob"""
+    result = [0, 0]
+    for side, move in decode(data):
+        result[side] |= engine.bit(move)
+    return result[HOST], result[OPPOENT]
@@ -0,0 +1,80 @@
+"""counters.py - Sharded counters.
+
+A named counter is split into NUM_SHARDS CounterShard entities, each in its
+own entity group, and an increment only writes one shard picked at random,
+so a busy counter takes NUM_SHARDS times the write rate of a single entity.
+The total is the sum of the shards, cached in memcache for CACHE_TIME
+seconds and kept up to date by the increments once they commit."""
+
+import random
+
+from google.appengine.api import memcache
+from google.appengine.ext import ndb
+
+NUM_SHARDS = 20
+CACHE_TIME = 60
+NAMESPACE = 'counters'
+
+
+class CounterShard(ndb.Model):
+    """Shard of a named counter"""
+    count = ndb.IntegerProperty(default=0, indexed=False)
+
+
+def _shard_keys(name):
+    return [ndb.Key(CounterShard, '{}:{}'.format(name, index))
+            for index in range(NUM_SHARDS)]
+
+
+def increments(deltas):
+    """Adds the deltas (a dictionary of counter name to delta) to a random
+    shard of each counter and returns the shards for the caller to put.
+    Call from the transaction that puts them: the cached totals are updated
+    when it commits."""
+    keys = [ndb.Key(CounterShard, '{}:{}'.format(
+        name, random.randint(0, NUM_SHARDS - 1))) for name in deltas]
+    shards = ndb.get_multi(keys)
+    for index, (name, delta) in enumerate(deltas.items()):
+        if shards[index] is None:
+            shards[index] = CounterShard(key=keys[index])
+        shards[index].count += delta
+    # Only counters whose total is already cached are offset.
+    ndb.get_context().call_on_commit(
+        lambda: memcache.offset_multi(deltas, namespace=NAMESPACE))
+    return shards
+
+
+@ndb.transactional(xg=True)
+def increment(name, delta=1):
+    """Adds the delta to the counter"""
+    ndb.put_multi(increments({name: delta}))
+
+
+def get_counts(names, cached=True):
+    """Returns a dictionary of counter name to total, reading the totals
+    that are not cached (or all of them if cached is False) from all their
+    shards with one get_multi"""
+    if cached:
+        counts = memcache.get_multi(names, namespace=NAMESPACE)
+    else:
+        counts = {}
+    missing = [name for name in names if name not in counts]
+    if missing:
+        keys = []
+        for name in missing:
+            keys.extend(_shard_keys(name))
+        shards = ndb.get_multi(keys)
+        totals = {}
+        for index, name in enumerate(missing):
+            totals[name] = sum(shard.count for shard in
+                               shards[index * NUM_SHARDS:
+                                      (index + 1) * NUM_SHARDS]
+                               if shard)
+        memcache.add_multi(totals, time=CACHE_TIME, namespace=NAMESPACE)
+        counts.update(totals)
+    return counts
+
+
+def get_count(name):
+    """Returns the total of the counter"""
+    return get_counts([name])[name]
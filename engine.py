@@ -0,0 +1,96 @@
+"""engine.py - Bitboard representation of a Tic-Tac-Toe board.
+
+Each player's marks are kept in a 9-bit integer where bit (n - 1) is set when
+the player has taken position n of the board:
+
+1, 2, 3
+
+4, 5, 6
+
+7, 8, 9
+
+Win detection is a single lookup into a table precomputed for all 512
+possible boards, and the free positions of a game are the bits missing from
+the union of both players' boards."""
+
+FULL_BOARD = 0x1FF
+
+WIN_PATTERNS = ((1, 2, 3), (4, 5, 6), (7, 8, 9), (1, 4, 7),
+                (2, 5, 8), (3, 6, 9), (1, 5, 9), (3, 5, 7))
+
+BITS = tuple(1 << (position - 1) for position in range(1, 10))
+
+WIN_MASKS = tuple(sum(BITS[position - 1] for position in pattern)
+                  for pattern in WIN_PATTERNS)
+
+# WINNING[board] is True when the board contains at least one win pattern.
+WINNING = tuple(any(board & mask == mask for mask in WIN_MASKS)
+                for board in range(FULL_BOARD + 1))
+
+# POSITIONS[mask] lists the positions (1-9) whose bits are set in the mask.
+POSITIONS = tuple(tuple(position for position in range(1, 10)
+                        if mask & BITS[position - 1])
+                  for mask in range(FULL_BOARD + 1))
+
+
+def bit(move):
+    """Returns the bit for a board position (1-9)"""
+    return BITS[move - 1]
+
+
+def to_board(moves):
+    """Returns the bitboard for a sequence of positions (1-9)"""
+    board = 0
+    for move in moves:
+        board |= BITS[move - 1]
+    return board
+
+
+def is_winner(board):
+    """Check if the player's bitboard contains a win pattern"""
+    return WINNING[board]
+
+
+def free_mask(host_board, oppoent_board):
+    """Returns the bitboard of positions not yet taken by either player"""
+    return ~(host_board | oppoent_board) & FULL_BOARD
+
+
+def legal_moves(host_board, oppoent_board):
+    """Returns the positions (1-9) still available to play"""
+    return POSITIONS[free_mask(host_board, oppoent_board)]
+
+
+def is_legal(host_board, oppoent_board, move):
+    """Check if the move is on the board and not already taken"""
+    return 1 <= move <= 9 and \
+        not (host_board | oppoent_board) & BITS[move - 1]
+
+
+def is_full(host_board, oppoent_board):
+    """Check if every position on the board has been taken"""
+    return host_board | oppoent_board == FULL_BOARD
+
+
+# CODES[board] is the base 3 code of a board holding only digit 1 marks.
+CODES = tuple(sum(3 ** (position - 1) for position in POSITIONS[board])
+              for board in range(FULL_BOARD + 1))
+
+
+def encode(first_board, second_board):
+    """Returns the base 3 code of a position, one digit per board position
+    (1-9): 0 if free, 1 if taken by the player who moved first and 2 if
+    taken by the player who moved second"""
+    return CODES[first_board] + 2 * CODES[second_board]
+
+
+def decode(code):
+    """Returns the (first_board, second_board) of a base 3 code"""
+    first_board = second_board = 0
+    for index in range(9):
+        code, digit = divmod(code, 3)
+        if digit == 1:
+            first_board |= BITS[index]
+        elif digit == 2:
+            second_board |= BITS[index]
+    return first_board, second_board
@@ -0,0 +1,54 @@
+"""export.py - Export of the completed games as newline-delimited JSON.
+
+Completed games are walked by cursor through their Scores, a page at a time.
+The Games of a page are read with one get_multi (a Score's parent is its Game)
+and the players' names with another, and each game becomes one compact record.
+The moves of an archived game come from its Score, see archive.py:
+
+    {"key": <urlsafe game key>, "host": <name>, "oppoent": <name>,
+     "moves": "5193...", "host_result": "Won", "oppoent_result": "Lost",
+     "end_date": "2016-05-01T12:00:00"}
+
+moves lists the positions played, the oppoent first, see replay.py. Pages are
+served by the export_games endpoint and downloaded to a file with
+export_client.py."""
+
+import json
+
+from google.appengine.ext import ndb
+
+from models import Score
+
+RESULTS = ['Won', 'Tied', 'Lost', 'Forfeit']
+
+
+def to_record(score, plies, names):
+    """Returns the export record of a completed game"""
+    return {'key': score.game.urlsafe(),
+            'host': names[score.host],
+            'oppoent': names[score.oppoent],
+            'moves': ''.join(str(move) for _, move in plies),
+            'host_result': RESULTS[score.host_result],
+            'oppoent_result': RESULTS[score.oppoent_result],
+            'end_date': score.end_date.isoformat()}
+
+
+def get_page(limit, cursor=None):
+    """Returns the records of a page of completed games, in key order, and
+    the cursor of the next page, or None if there is none"""
+    scores, next_cursor, more = Score.query().order(Score.key).fetch_page(
+        limit, start_cursor=cursor)
+    games = ndb.get_multi([score.game for score in scores
+                           if not score.archived])
+    plies = dict((game.key, game.plies) for game in games if game)
+    names = Score.get_names(scores)
+    records = [to_record(score, score.plies if score.archived else
+                         plies[score.game], names)
+               for score in scores if score.archived or score.game in plies]
+    return records, next_cursor if more else None
+
+
+def to_lines(records):
+    """Returns the records as newline-delimited JSON"""
+    return ''.join(json.dumps(record, separators=(',', ':'), sort_keys=True) +
+                   '\n' for record in records)
@@ -0,0 +1,56 @@
+"""export_client.py - Downloads the completed games of a deployed API as
+newline-delimited JSON, see export.py.
+
+Pages are requested one after the other from the export_games endpoint with
+the cursor of the previous page and written out as they arrive, so the
+download runs in constant memory whatever the number of games.
+
+    python export_client.py https://<app-id>.appspot.com > games.ndjson
+    python replay.py games.ndjson
+"""
+
+import argparse
+import json
+import sys
+
+try:
+    from urllib import urlencode
+    from urllib2 import urlopen
+except ImportError:
+    from urllib.parse import urlencode
+    from urllib.request import urlopen
+
+EXPORT_PATH = '/_ah/api/Tic-Tac-Toe/v1/games/export'
+
+
+def pages(root, limit):
+    """Yields the NDJSON records of each page of the export"""
+    cursor = None
+    while True:
+        params = {'limit': limit}
+        if cursor:
+            params['cursor'] = cursor
+        response = urlopen('{}{}?{}'.format(root.rstrip('/'), EXPORT_PATH,
+                                            urlencode(params)))
+        try:
+            page = json.loads(response.read().decode('utf-8'))
+        finally:
+            response.close()
+        yield page.get('records', '')
+        cursor = page.get('next_cursor')
+        if not cursor:
+            return
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('root', help='root URL of the API')
+    parser.add_argument('--limit', type=int, default=500,
+                        help='games per page (500 at most)')
+    args = parser.parse_args()
+    for records in pages(args.root, args.limit):
+        sys.stdout.write(records)
+
+
+if __name__ == '__main__':
+    main()
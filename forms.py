@@ -10,15 +10,25 @@ class GameForm(messages.Message):
     next_turn = messages.StringField(6, required=True)
     start_date = messages.StringField(7, required=True)
     message = messages.StringField(8, required=True)
+    version = messages.IntegerField(9)
 
-class GameForms(message.Message):
+class HintForm(messages.Message):
+    """HintForm for the perfect-play evaluation of a game's position"""
+    urlsafe_key = messages.StringField(1, required=True)
+    outcome = messages.StringField(2, required=True)
+    depth = messages.IntegerField(3, required=True)
+    best_moves = messages.IntegerField(4, repeated=True)
+
+class GameForms(messages.Message):
     items = messages.MessageField(GameForm, 1, repeated=True)
 
 
 class NewGameForm(messages.Message):
-    """Used to create a new game"""
+    """Used to create a new game. Set ai_level instead of oppoent_name for a
+    single-player game"""
     host_name = messages.StringField(1, required=True)
-    oppoent_name = message.StringField(2, required=True)
+    oppoent_name = messages.StringField(2)
+    ai_level = messages.StringField(3)
 
 
 class MakeMoveForm(messages.Message):
@@ -27,6 +37,52 @@ class MakeMoveForm(messages.Message):
     move = messages.IntegerField(2, required=True)
 
 
+class BatchMoveForm(messages.Message):
+    """A move in one of the games of a make_moves_batch request"""
+    urlsafe_game_key = messages.StringField(1, required=True)
+    player_name = messages.StringField(2, required=True)
+    move = messages.IntegerField(3, required=True)
+
+
+class BatchMovesForm(messages.Message):
+    """Used to make moves in several games at once"""
+    moves = messages.MessageField(BatchMoveForm, 1, repeated=True)
+
+
+class MoveResultForm(messages.Message):
+    """Outcome of a move of a make_moves_batch request: the game state, or
+    the error if the game or player was not found or it is not their turn"""
+    urlsafe_game_key = messages.StringField(1, required=True)
+    game = messages.MessageField(GameForm, 2)
+    error = messages.StringField(3)
+
+
+class MoveResultForms(messages.Message):
+    """Return multiple MoveResultForms"""
+    items = messages.MessageField(MoveResultForm, 1, repeated=True)
+
+
+class NewTournamentForm(messages.Message):
+    """Used to create a tournament, format being round_robin or
+    single_elimination"""
+    name = messages.StringField(1, required=True)
+    format = messages.StringField(2, required=True)
+    player_names = messages.StringField(3, repeated=True)
+
+
+class TournamentForm(messages.Message):
+    """TournamentForm for outbound tournament state information"""
+    urlsafe_key = messages.StringField(1, required=True)
+    name = messages.StringField(2, required=True)
+    format = messages.StringField(3, required=True)
+    players = messages.IntegerField(4, required=True)
+    round = messages.IntegerField(5, required=True)
+    rounds = messages.IntegerField(6, required=True)
+    status = messages.StringField(7, required=True)
+    winner_name = messages.StringField(8)
+    start_date = messages.StringField(9, required=True)
+
+
 class ScoreForm(messages.Message):
     """ScoreForm for outbound Score information"""
     host_name = messages.StringField(1, required=True)
@@ -39,12 +95,49 @@ class ScoreForm(messages.Message):
 class ScoreForms(messages.Message):
     """Return multiple ScoreForms"""
     items = messages.MessageField(ScoreForm, 1, repeated=True)
+    next_cursor = messages.StringField(2)
 
 
 class StringMessage(messages.Message):
     """StringMessage-- outbound (single) string message"""
     message = messages.StringField(1, required=True)
 
+class CacheStatsForm(messages.Message):
+    """CacheStatsForm for the hit/miss counts of the entity cache"""
+    hits = messages.IntegerField(1, required=True)
+    misses = messages.IntegerField(2, required=True)
+
+class RpcCountForm(messages.Message):
+    """RpcCountForm for the number of calls of an API method"""
+    rpc = messages.StringField(1, required=True)
+    count = messages.IntegerField(2, required=True)
+
+class ProfileForm(messages.Message):
+    """ProfileForm for the sampled calls of an endpoint or handler. The
+    buckets count the calls by latency and by API payload bytes, see the
+    bounds in ProfileForms"""
+    name = messages.StringField(1, required=True)
+    calls = messages.IntegerField(2, required=True)
+    errors = messages.IntegerField(3, required=True)
+    mean_ms = messages.FloatField(4, required=True)
+    max_ms = messages.FloatField(5, required=True)
+    p50_ms = messages.IntegerField(6, required=True)
+    p99_ms = messages.IntegerField(7, required=True)
+    latency_buckets = messages.IntegerField(8, repeated=True)
+    payload_buckets = messages.IntegerField(9, repeated=True)
+    rpcs = messages.MessageField(RpcCountForm, 10, repeated=True)
+    request_bytes = messages.IntegerField(11, required=True)
+    response_bytes = messages.IntegerField(12, required=True)
+
+class ProfileForms(messages.Message):
+    """ProfileForms for the profiles of an instance. Bucket i counts the
+    values up to bound i, the last bucket the values above every bound"""
+    instance = messages.StringField(1)
+    sample_rate = messages.FloatField(2, required=True)
+    latency_bounds_ms = messages.IntegerField(3, repeated=True)
+    payload_bounds = messages.IntegerField(4, repeated=True)
+    items = messages.MessageField(ProfileForm, 5, repeated=True)
+
 class UserForm(messages.Message):
     """User Form"""
     name = messages.StringField(1, required=True)
@@ -55,4 +148,47 @@ class UserForm(messages.Message):
 
 class UserForms(messages.Message):
     """Container for multiple User Forms"""
-    items = messages.MessageField(UserForm, 1, repeated=True)
\ No newline at end of file
+    items = messages.MessageField(UserForm, 1, repeated=True)
+    next_cursor = messages.StringField(2)
+
+
+class ExportForm(messages.Message):
+    """ExportForm for a page of completed games as newline-delimited JSON
+    records, see export.py"""
+    records = messages.StringField(1, required=True)
+    count = messages.IntegerField(2, required=True)
+    next_cursor = messages.StringField(3)
+
+
+class PositionStatsForm(messages.Message):
+    """PositionStatsForm for the outcomes of the games through a position"""
+    position = messages.IntegerField(1, required=True)
+    next_turn = messages.StringField(2, required=True)
+    games = messages.IntegerField(3, required=True)
+    first_player_wins = messages.IntegerField(4, required=True)
+    second_player_wins = messages.IntegerField(5, required=True)
+    draws = messages.IntegerField(6, required=True)
+    win_rate = messages.FloatField(7, required=True)
+
+
+class OpeningStatsForm(messages.Message):
+    """OpeningStatsForm for a player's results in an opening. position is
+    the first move, up to symmetry: 1 (corner), 2 (edge) or 5 (center)"""
+    position = messages.IntegerField(1, required=True)
+    side = messages.StringField(2, required=True)
+    won = messages.IntegerField(3, required=True)
+    tied = messages.IntegerField(4, required=True)
+    lost = messages.IntegerField(5, required=True)
+
+
+class OpeningProfileForm(messages.Message):
+    """OpeningProfileForm for the results of a player per opening"""
+    player_name = messages.StringField(1, required=True)
+    openings = messages.MessageField(OpeningStatsForm, 2, repeated=True)
+
+
+class RankForm(messages.Message):
+    """RankForm for the rank of a Player on the leaderboard"""
+    player = messages.MessageField(UserForm, 1, required=True)
+    rank = messages.IntegerField(2, required=True)
+    ranked_players = messages.IntegerField(3, required=True)
@@ -0,0 +1,143 @@
+"""gametree.py - Precomputed perfect-play table for every reachable position.
+
+Positions are keyed by their symmetry class ID (see symmetry.py), the base 3
+code of the canonical board, so the 5,478 reachable positions are stored as
+765 entries. Each entry is 16 bits:
+
+    bits 0-8    best moves on the canonical board (bit n-1 for position n)
+    bits 9-12   number of plies left until the game ends under perfect play
+    bits 13-14  outcome for the player to move (Win, Draw or Loss)
+
+The table is generated offline by running this file and is loaded once per
+instance by get_table().
+"""
+
+import os
+import sys
+from array import array
+
+import engine
+import symmetry
+
+WIN, DRAW, LOSS = range(3)
+OUTCOMES = ['Win', 'Draw', 'Loss']
+
+SIZE = 3 ** 9
+UNREACHABLE = 0xFFFF
+TABLE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                          'gametree.dat')
+
+_table = None
+
+
+def pack(outcome, depth, best):
+    """Packs a table entry"""
+    return outcome << 13 | depth << 9 | best
+
+
+def _solve(first, second, table):
+    """Fills in the entry of the position and every position reachable from
+    it into a table indexed by base 3 code. Returns the (outcome, depth) for
+    the player to move"""
+    code = engine.encode(first, second)
+    entry = table[code]
+    if entry != UNREACHABLE:
+        return entry >> 13 & 0x3, entry >> 9 & 0xF
+    first_to_move = bin(first | second).count('1') % 2 == 0
+    if engine.is_winner(second if first_to_move else first):
+        table[code] = pack(LOSS, 0, 0)
+        return LOSS, 0
+    free = engine.free_mask(first, second)
+    if not free:
+        table[code] = pack(DRAW, 0, 0)
+        return DRAW, 0
+
+    best_key = None
+    best = 0
+    for position in engine.POSITIONS[free]:
+        mask = engine.BITS[position - 1]
+        if first_to_move:
+            outcome, depth = _solve(first | mask, second, table)
+        else:
+            outcome, depth = _solve(first, second | mask, table)
+        # Prefer winning, then drawing; win fast and lose slowly.
+        if outcome == LOSS:
+            key = (WIN, depth)
+        elif outcome == DRAW:
+            key = (DRAW, 0)
+        else:
+            key = (LOSS, -depth)
+        if best_key is None or key < best_key:
+            best_key, best = key, mask
+        elif key == best_key:
+            best |= mask
+    outcome = best_key[0]
+    if outcome == DRAW:
+        # A draw only ends when the board is full.
+        depth = 9 - bin(first | second).count('1')
+    else:
+        depth = 1 + abs(best_key[1])
+    table[code] = pack(outcome, depth, best)
+    return outcome, depth
+
+
+def generate():
+    """Solves the game from the empty board and returns the table as a
+    dictionary of symmetry class ID to entry"""
+    solved = array('H', [UNREACHABLE]) * SIZE
+    _solve(0, 0, solved)
+    return dict((code, entry) for code, entry in enumerate(solved)
+                if entry != UNREACHABLE and symmetry.is_canonical(code))
+
+
+def save(table, path=TABLE_PATH):
+    """Writes the table to disk as little-endian 16-bit (code, entry)
+    pairs"""
+    pairs = array('H')
+    for code in sorted(table):
+        pairs.append(code)
+        pairs.append(table[code])
+    if sys.byteorder != 'little':
+        pairs.byteswap()
+    with open(path, 'wb') as f:
+        pairs.tofile(f)
+
+
+def load(path=TABLE_PATH):
+    """Reads a table written by save()"""
+    pairs = array('H')
+    with open(path, 'rb') as f:
+        pairs.fromfile(f, os.fstat(f.fileno()).st_size // pairs.itemsize)
+    if sys.byteorder != 'little':
+        pairs.byteswap()
+    return dict(zip(pairs[::2], pairs[1::2]))
+
+
+def get_table():
+    """Returns the table, loading it on first use. Falls back to solving the
+    game in memory if the file has not been generated"""
+    global _table
+    if _table is None:
+        try:
+            _table = load()
+        except (IOError, EOFError):
+            _table = generate()
+    return _table
+
+
+def lookup(first_board, second_board):
+    """Returns the (outcome, depth, best moves) for the player to move, or
+    None if the position cannot be reached in a game"""
+    class_id, transform = symmetry.canonical(first_board, second_board)
+    entry = get_table().get(class_id)
+    if entry is None:
+        return None
+    best = symmetry.untransform(entry & 0x1FF, transform)
+    return entry >> 13 & 0x3, entry >> 9 & 0xF, engine.POSITIONS[best]
+
+
+if __name__ == '__main__':
+    table = generate()
+    save(table)
+    sys.stdout.write('Wrote {} symmetry classes to {}\n'.format(
+        len(table), TABLE_PATH))
@@ -0,0 +1,138 @@
+"""leaderboard.py - Materialized leaderboard of the players ranked by win rate.
+
+Each player with at least one completed game has a LeaderboardEntry holding
+their stats and win rate, updated by a task enqueued by end_game. Pages of
+the leaderboard are read with an ordered query on the entries.
+
+The number of entries per whole-percent win rate bucket is kept in a
+histogram, sharded like counters.py, so the rank of a player is the number of
+entries in the buckets above theirs plus one count query within their own
+bucket, without scanning all players."""
+
+import random
+
+from google.appengine.api import memcache
+from google.appengine.ext import ndb
+
+import counters
+from forms import UserForm
+from models import Player
+
+BUCKETS = 101
+NUM_SHARDS = 20
+CACHE_TIME = 60
+NAMESPACE = 'leaderboard'
+HISTOGRAM_KEY = 'histogram'
+
+
+class LeaderboardEntry(ndb.Model):
+    """Leaderboard entry of a player, keyed by the player's ID"""
+    player = ndb.KeyProperty(kind='Player', required=True, indexed=False)
+    name = ndb.StringProperty(required=True, indexed=False)
+    email = ndb.StringProperty(required=True, indexed=False)
+    won = ndb.IntegerProperty(default=0, indexed=False)
+    played = ndb.IntegerProperty(default=0, indexed=False)
+    win_rate = ndb.FloatProperty(default=0.0)
+    bucket = ndb.IntegerProperty(default=0)
+
+    @classmethod
+    def key_for(cls, player_key):
+        return ndb.Key(cls, player_key.id())
+
+    def to_form(self):
+        return UserForm(name = self.name,
+            email = self.email,
+            won = self.won,
+            played = self.played)
+
+
+class LeaderboardShard(ndb.Model):
+    """Shard of the number of entries per win rate bucket"""
+    counts = ndb.IntegerProperty(repeated=True, indexed=False)
+
+
+def _bucket(win_rate):
+    return min(int(win_rate), BUCKETS - 1)
+
+
+@ndb.transactional(xg=True)
+def _update_entry(player, won, played):
+    """Writes the player's entry and, if their bucket changed, moves them
+    from their old bucket to the new one in a random histogram shard"""
+    key = LeaderboardEntry.key_for(player.key)
+    entry = key.get()
+    old_bucket = entry.bucket if entry else None
+    if not entry:
+        entry = LeaderboardEntry(key=key, player=player.key,
+                                 name=player.name, email=player.email)
+    entry.won, entry.played = won, played
+    entry.win_rate = Player.win_rate(won, played)
+    entry.bucket = _bucket(entry.win_rate)
+    entities = [entry]
+
+    if entry.bucket != old_bucket:
+        shard_key = ndb.Key(LeaderboardShard, random.randint(1, NUM_SHARDS))
+        shard = shard_key.get() or LeaderboardShard(key=shard_key,
+                                                    counts=[0] * BUCKETS)
+        if old_bucket is not None:
+            shard.counts[old_bucket] -= 1
+        shard.counts[entry.bucket] += 1
+        entities.append(shard)
+        ndb.get_context().call_on_commit(
+            lambda: memcache.delete(HISTOGRAM_KEY, namespace=NAMESPACE))
+    ndb.put_multi(entities)
+
+
+def update(player_keys):
+    """Brings the entries of the players up to date with their counters.
+    Safe to run more than once for the same result"""
+    players = ndb.get_multi(player_keys)
+    names = []
+    for key in player_keys:
+        names.append(Player.stat_name(key, 'won'))
+        names.append(Player.stat_name(key, 'played'))
+    # Read the shards: the cached totals may not be offset yet.
+    counts = counters.get_counts(names, cached=False)
+    for index, player in enumerate(players):
+        if player:
+            _update_entry(player, counts[names[2 * index]],
+                          counts[names[2 * index + 1]])
+
+
+def get_histogram():
+    """Returns the number of entries in each bucket"""
+    histogram = memcache.get(HISTOGRAM_KEY, namespace=NAMESPACE)
+    if histogram is None:
+        histogram = [0] * BUCKETS
+        shards = ndb.get_multi([ndb.Key(LeaderboardShard, index)
+                                for index in range(1, NUM_SHARDS + 1)])
+        for shard in shards:
+            if shard:
+                for bucket, count in enumerate(shard.counts):
+                    histogram[bucket] += count
+        memcache.add(HISTOGRAM_KEY, histogram, time=CACHE_TIME,
+                     namespace=NAMESPACE)
+    return histogram
+
+
+def get_page(limit, cursor=None):
+    """Returns a page of entries ordered by win rate and the cursor of the
+    next page, or None if there is none"""
+    entries, next_cursor, more = LeaderboardEntry.query().order(
+        -LeaderboardEntry.win_rate).fetch_page(limit, start_cursor=cursor)
+    return entries, next_cursor if more else None
+
+
+def get_rank(player_key):
+    """Returns the player's entry, rank (1 for the best win rate, players
+    with the same win rate share a rank) and the number of ranked players.
+    Returns None if the player has not completed a game"""
+    entry = LeaderboardEntry.key_for(player_key).get()
+    if not entry:
+        return None
+    histogram = get_histogram()
+    above = sum(histogram[entry.bucket + 1:])
+    above += LeaderboardEntry.query(
+        LeaderboardEntry.bucket == entry.bucket,
+        LeaderboardEntry.win_rate > entry.win_rate).count()
+    return entry, above + 1, sum(histogram)
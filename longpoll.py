@@ -0,0 +1,53 @@
+"""longpoll.py - Waits for a version counter to change.
+
+wait_for_turn holds a request open until the version of the game, bumped by
+cache.py on every put, differs from the version the client last saw. The
+counter is read from memcache with a backoff between reads, which is much
+cheaper than the client polling get_game: a read of one integer inside the
+instance instead of a request and a read of the game.
+
+InMemoryVersions is a stand-in for the memcache counters used by the local
+harness in benchmarks/long_poll.py."""
+
+import threading
+import time
+
+DEFAULT_TIMEOUT = 20
+MAX_TIMEOUT = 30
+MIN_INTERVAL = 0.05
+MAX_INTERVAL = 1.0
+
+
+def poll(get_version, key, known_version, timeout=DEFAULT_TIMEOUT,
+         sleep=time.sleep, clock=time.time):
+    """Reads the version of the key with get_version until it differs from
+    known_version or the timeout (in seconds, capped at MAX_TIMEOUT) expires.
+    Returns the last version read"""
+    deadline = clock() + min(timeout, MAX_TIMEOUT)
+    interval = MIN_INTERVAL
+    while True:
+        version = get_version(key)
+        remaining = deadline - clock()
+        if version != known_version or remaining <= 0:
+            return version
+        sleep(min(interval, remaining))
+        interval = min(interval * 2, MAX_INTERVAL)
+
+
+class InMemoryVersions(object):
+    """Version counters kept in memory, counting the number of reads"""
+
+    def __init__(self):
+        self.reads = 0
+        self._versions = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            self.reads += 1
+            return self._versions.get(key, 0)
+
+    def bump(self, key):
+        with self._lock:
+            self._versions[key] = self._versions.get(key, 0) + 1
+            return self._versions[key]
@@ -0,0 +1,53 @@
+"""lru.py - A bounded in-instance cache with least recently used eviction."""
+
+import threading
+from collections import OrderedDict
+
+
+class LRUCache(object):
+    """Maps keys to values, keeping at most max_size entries. When full, the
+    entry that was read or written the longest time ago is evicted. Safe to
+    share between the threads of an instance."""
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._items)
+
+    def get(self, key, default=None):
+        """Returns the value of the key and marks it as recently used"""
+        with self._lock:
+            try:
+                value = self._items.pop(key)
+            except KeyError:
+                self.misses += 1
+                return default
+            self._items[key] = value
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        """Sets the value of the key, evicting the least recently used entry
+        if the cache is full"""
+        with self._lock:
+            self._items.pop(key, None)
+            if len(self._items) >= self.max_size:
+                self._items.popitem(last=False)
+            self._items[key] = value
+
+    def delete(self, key):
+        """Removes the key from the cache if present"""
+        with self._lock:
+            self._items.pop(key, None)
+
+    def clear(self):
+        """Removes every entry and resets the hit/miss counters"""
+        with self._lock:
+            self._items.clear()
+            self.hits = 0
+            self.misses = 0
@@ -5,102 +5,305 @@ cronjobs."""
 import logging
 
 import webapp2
-from google.appengine.api import mail, app_identity
-from api import GuessANumberApi
+from google.appengine.api import mail, app_identity, taskqueue
+from google.appengine.ext import ndb
 
-from models import Player, Game
+from models import Player, Game, GameState, ActiveGames, Rating, \
+    GameInSessionError
+from utils import get_key_by_urlsafe, get_cursor_by_urlsafe
+import archive
+import leaderboard
+import matchmaking
+import outbox
+import profiling
+import reminders
+import stats
+import tournament
 
 
 class SendReminderEmail(webapp2.RequestHandler):
+    @profiling.profiled
     def get(self):
         """Send a reminder email to each User with an email who has
         games in progress. Email body includes a count of active games and their
         urlsafe keys
-        Called every hour using a cron job"""
+        Called every hour using a cron job. Enqueues one SendReminders task
+        per page of players with active games, see reminders.py"""
+        query = ActiveGames.query(ActiveGames.has_active == True)
+        tasks = []
+        cursor = None
+        more = True
+        while more:
+            keys, next_cursor, more = query.fetch_page(
+                reminders.BATCH_SIZE, start_cursor=cursor, keys_only=True)
+            if keys:
+                tasks.append(taskqueue.Task(url=reminders.WORKER_URL, params={
+                    'cursor': cursor.urlsafe() if cursor else '',
+                    'end_cursor': next_cursor.urlsafe() if more else ''}))
+            cursor = next_cursor
+        queue = taskqueue.Queue(reminders.QUEUE_NAME)
+        for batch in reminders.chunks(tasks, reminders.MAX_TASKS_PER_ADD):
+            queue.add(batch)
+        logging.info('Enqueued {} reminder batches'.format(len(tasks)))
+
+class SendReminders(webapp2.RequestHandler):
+    @profiling.profiled
+    def post(self):
+        """Send the reminder emails of a page of players with active games,
+        one email per player"""
         app_id = app_identity.get_application_id()
-        players = Player.query(player.email != None)
-        for player in players:
-            games = Game.query(ndb.OR(Game.host == user.key,
-                                      Game.oppoent == user.key)).filter(Game.status == 0)
-            if games.count() > 0:
-                subject = 'This is a reminder!'
-                body = 'Hi {}, you have {} games in progress. Their keys are: {}.'.format(player.name,
-                           games.count(),
-                           '\n'.join(game.key.urlsafe() for game in games))
-                logging.debug(body)
-                """This will send test emails, the arguments to send_mail are:
-                from, to, subject, body"""
-                mail.send_mail('noreply@{}.appspotmail.com'.
-                               format(app_id),
-                               player.email,
-                               subject,
-                               body)
-
-class SendMoveEmail(webapp2.RequestHandler):
+        cursor = get_cursor_by_urlsafe(self.request.get('cursor'))
+        end_cursor = get_cursor_by_urlsafe(self.request.get('end_cursor'))
+        # The page ends where the next one starts, even if players were
+        # added to it since the cron job; the last page has no end
+        indexes = ActiveGames.query(ActiveGames.has_active == True).fetch(
+            None if end_cursor else reminders.BATCH_SIZE,
+            start_cursor=cursor, end_cursor=end_cursor)
+        players = ndb.get_multi([index.player for index in indexes])
+        batch = [reminders.build_reminder(
+                     player.name, player.email,
+                     [key.urlsafe() for key in index.games])
+                 for index, player in zip(indexes, players)
+                 if player and player.email]
+        reminders.send_reminders(batch, mail.send_mail,
+                                 'noreply@{}.appspotmail.com'.format(app_id))
+
+class DrainOutbox(webapp2.RequestHandler):
+    @profiling.profiled
+    def post(self):
+        """Send the pending notifications of the games, one email per
+        player and game, see outbox.py"""
+        app_id = app_identity.get_application_id()
+        sent = 0
+        for urlsafe in self.request.get_all('game_key'):
+            sent += outbox.drain(get_key_by_urlsafe(urlsafe, Game),
+                                 mail.send_mail,
+                                 'noreply@{}.appspotmail.com'.format(app_id))
+        logging.debug('Sent {} notification emails'.format(sent))
+
+class UpdateLeaderboard(webapp2.RequestHandler):
+    @profiling.profiled
+    def post(self):
+        """Update the ratings and the leaderboard entries of the players of a
+        completed game"""
+        if self.request.get('game_key'):
+            Rating.apply(get_key_by_urlsafe(self.request.get('game_key'),
+                                            Game))
+        leaderboard.update([get_key_by_urlsafe(urlsafe, Player)
+                            for urlsafe in self.request.get_all('user_key')])
+
+class CreateTournamentRound(webapp2.RequestHandler):
+    @profiling.profiled
+    def post(self):
+        """Create the games of a tournament round, see tournament.py"""
+        tournament_key = get_key_by_urlsafe(
+            self.request.get('tournament_key'), tournament.Tournament)
+        try:
+            created = tournament.create_round(tournament_key,
+                                              int(self.request.get('round')))
+        except GameInSessionError as e:
+            # Retried by the queue until the players end their other game
+            logging.info(str(e))
+            self.error(503)
+            return
+        logging.info('Created {} tournament games'.format(created))
+
+class AdvanceTournament(webapp2.RequestHandler):
+    @profiling.profiled
     def post(self):
-        """Send an email to a User that it is their turn"""
-        player = get_by_urlsafe(self.request.get('player_key'), Player)
-        game = get_by_urlsafe(self.request.get('game_key'), Game)
-        subject = 'A Tic-Tac-Toe Game - It\'s your turn!'
-        body = 'Hi {}, You\' oppoent has made a move!. Now it\'s your turn to play.'\
-        ' The game key is: {}'.format(player.name, game.key.urlsafe())
-        logging.debug(body)
-        mail.send_mail('noreply@{}.appspotmail.com'.
-                       format(app_id),
-                       player.email,
-                       subject,
-                       body)
-
-class SendForfeitEmail(webapp2.RequestHandler):
+        """Close a tournament round if its last game has ended"""
+        tournament_key = get_key_by_urlsafe(
+            self.request.get('tournament_key'), tournament.Tournament)
+        tournament.advance(tournament_key, int(self.request.get('round')))
+
+class MatchPlayersCron(webapp2.RequestHandler):
+    @profiling.profiled
+    def get(self):
+        """Restart the pairing of the waiting players if it has stopped.
+        Called every minute using a cron job"""
+        matchmaking.schedule()
+
+class MatchPlayers(webapp2.RequestHandler):
+    @profiling.profiled
     def post(self):
-        """Send an email to a User that it is their turn"""
-        player = get_by_urlsafe(self.request.get('player_key'), Player)
-        game = get_by_urlsafe(self.request.get('game_key'), Game)
-        subject = 'A Tic-Tac-Toe Game - It\'s your turn!'
-        body = 'Hi {}, Your oppoent has surrendered!.'\
-        ' The game key is: {}'.format(player.name, game.key.urlsafe())
-        logging.debug(body)
-        mail.send_mail('noreply@{}.appspotmail.com'.
-                       format(app_id),
-                       player.email,
-                       subject,
-                       body)
-
-class SendCongratsEmail(webapp2.RequestHandler):
+        """Pair the waiting players and create their games, see
+        matchmaking.py"""
+        created = matchmaking.match()
+        logging.info('Created {} matchmaking games'.format(created))
+
+class AggregateGame(webapp2.RequestHandler):
+    @profiling.profiled
     def post(self):
-        """Send email to the winning player comparing their score to average."""
-        player = get_by_urlsafe(self.request.get('player_key'), Player)
-        game = get_by_urlsafe(self.request.get('game_key'), Game)
-        subject = 'Congratulations'
-        body = 'Congratulations {}, for completing the game  {}. '\
-               'You have won {} game(s). Your win rate is {}%. '\
-               'Keep it up!'.format(player.name, game.key.urlsafe(),
-                                    player.won, player.get_win_rate())
-        logging.debug(body)
-        mail.send_mail('noreply@{}.appspotmail.com'.
-                       format(app_id),
-                       player.email,
-                       subject, body)
-
-class SendFinishEmail(webapp2.RequestHandler):
+        """Add a completed game to the position and opening statistics, see
+        stats.py"""
+        stats.aggregate(get_key_by_urlsafe(self.request.get('game_key'), Game))
+
+class BackfillStats(webapp2.RequestHandler):
+    @profiling.profiled
+    def get(self):
+        """Start aggregating the games completed before the statistics
+        existed. Visit once after deploying"""
+        taskqueue.add(url=stats.BACKFILL_URL)
+        self.response.write('Backfill started')
+
+    @profiling.profiled
+    def post(self):
+        """Enqueue the aggregation of a batch of completed games, then the
+        task of the next batch. Games aggregated already are skipped"""
+        cursor = get_cursor_by_urlsafe(self.request.get('cursor'))
+        keys, next_cursor, more = Game.query(
+            Game.status == GameState.Completed).fetch_page(
+                stats.BACKFILL_BATCH, start_cursor=cursor, keys_only=True)
+        if keys:
+            taskqueue.Queue().add([
+                taskqueue.Task(url=stats.AGGREGATE_URL,
+                               params={'game_key': key.urlsafe()})
+                for key in keys])
+        if more:
+            taskqueue.add(url=stats.BACKFILL_URL,
+                          params={'cursor': next_cursor.urlsafe()})
+
+class ArchiveGamesCron(webapp2.RequestHandler):
+    @profiling.profiled
+    def get(self):
+        """Start archiving the old completed games, see archive.py. Called
+        every day using a cron job"""
+        archive.start()
+
+class ArchiveGames(webapp2.RequestHandler):
+    @profiling.profiled
+    def post(self):
+        """Archive a page of old completed games, then enqueue the task of
+        the next page. The last page records where the next run starts"""
+        cutoff = archive.parse_date(self.request.get('cutoff'))
+        kept = archive.parse_date(self.request.get('kept'))
+        cursor = get_cursor_by_urlsafe(self.request.get('cursor'))
+        archived, first_kept, next_cursor = archive.archive_page(cutoff,
+                                                                 cursor)
+        logging.info('Archived {} games'.format(archived))
+        kept = kept or first_kept
+        if next_cursor:
+            taskqueue.add(url=archive.WORKER_URL, params={
+                'cutoff': self.request.get('cutoff'),
+                'kept': kept.strftime(archive.DATE_FORMAT) if kept else '',
+                'cursor': next_cursor.urlsafe()})
+        else:
+            archive.finish(kept or cutoff)
+
+class MigrateGames(webapp2.RequestHandler):
+    BATCH_SIZE = 100
+
+    @profiling.profiled
+    def get(self):
+        """Start the migration of the games stored with the legacy pickled
+        lists. Visit once after deploying; runs as a chain of tasks"""
+        taskqueue.add(url='/tasks/migrate_games')
+        self.response.write('Migration started')
+
+    @profiling.profiled
+    def post(self):
+        """Migrate a batch of games to the packed moves (see codec.py), then
+        enqueue the task of the next batch"""
+        cursor = get_cursor_by_urlsafe(self.request.get('cursor'))
+        games, next_cursor, more = Game.query().fetch_page(
+            self.BATCH_SIZE, start_cursor=cursor)
+        legacy = [game.key for game in games if game.has_legacy_properties()]
+        for key in legacy:
+            Game.migrate_by_key(key)
+        logging.info('Migrated {} of {} games'.format(len(legacy), len(games)))
+        if more:
+            taskqueue.add(url='/tasks/migrate_games',
+                          params={'cursor': next_cursor.urlsafe()})
+
+class ReindexActiveGames(webapp2.RequestHandler):
+    BATCH_SIZE = 100
+
+    @profiling.profiled
+    def get(self):
+        """Start storing has_active in the active games indexes written
+        before it existed. Visit once after deploying"""
+        taskqueue.add(url='/tasks/reindex_active_games')
+        self.response.write('Reindexing started')
+
+    @profiling.profiled
+    def post(self):
+        """Put a batch of active games indexes again, then enqueue the task
+        of the next batch"""
+        cursor = get_cursor_by_urlsafe(self.request.get('cursor'))
+        keys, next_cursor, more = ActiveGames.query().fetch_page(
+            self.BATCH_SIZE, start_cursor=cursor, keys_only=True)
+        for key in keys:
+            ActiveGames.reindex_by_key(key)
+        logging.info('Reindexed {} active games indexes'.format(len(keys)))
+        if more:
+            taskqueue.add(url='/tasks/reindex_active_games',
+                          params={'cursor': next_cursor.urlsafe()})
+
+class ReservePlayers(webapp2.RequestHandler):
+    BATCH_SIZE = 100
+
+    @profiling.profiled
+    def get(self):
+        """Start reserving the names and emails of the players created
+        before reservations existed. Visit once after deploying"""
+        taskqueue.add(url='/tasks/reserve_players')
+        self.response.write('Reservation started')
+
+    @profiling.profiled
+    def post(self):
+        """Reserve the names and emails of a batch of players, then enqueue
+        the task of the next batch"""
+        cursor = get_cursor_by_urlsafe(self.request.get('cursor'))
+        players, next_cursor, more = Player.query().fetch_page(
+            self.BATCH_SIZE, start_cursor=cursor)
+        for player in players:
+            player.reserve()
+        if more:
+            taskqueue.add(url='/tasks/reserve_players',
+                          params={'cursor': next_cursor.urlsafe()})
+
+class MigrateStats(webapp2.RequestHandler):
+    BATCH_SIZE = 100
+
+    @profiling.profiled
+    def get(self):
+        """Start moving the won and played stored on the players before the
+        counters existed into their counters. Visit once after deploying"""
+        taskqueue.add(url='/tasks/migrate_stats')
+        self.response.write('Stats migration started')
+
+    @profiling.profiled
     def post(self):
-        """Send email to the winning player comparing their score to average."""
-        player = get_by_urlsafe(self.request.get('player_key'), Player)
-        game = get_by_urlsafe(self.request.get('game_key'), Game)
-        subject = 'It\'s a tie!'
-        body = 'The game {} has tied!'\
-                'Thank you for playing!'.format(game.key.urlsafe())
-        logging.debug(body)
-        mail.send_mail('noreply@{}.appspotmail.com'.
-                       format(app_id),
-                       player.email,
-                       subject, body)
+        """Move the stats of a batch of players into their counters and
+        update their leaderboard entries, then enqueue the task of the next
+        batch"""
+        cursor = get_cursor_by_urlsafe(self.request.get('cursor'))
+        keys, next_cursor, more = Player.query().fetch_page(
+            self.BATCH_SIZE, start_cursor=cursor, keys_only=True)
+        migrated = [key for key in keys if Player.migrate_stats_by_key(key)]
+        leaderboard.update(migrated)
+        logging.info('Migrated the stats of {} of {} players'.format(
+            len(migrated), len(keys)))
+        if more:
+            taskqueue.add(url='/tasks/migrate_stats',
+                          params={'cursor': next_cursor.urlsafe()})
 
 
 app = webapp2.WSGIApplication([
     ('/crons/send_reminder', SendReminderEmail),
-    ('/tasks/send_move_email', SendMoveEmail),
-    ('/tasks/send_congrats_mail', SendCongratsEmail),
-    ('/task/send_forfeit_email', SendForfeitEmail),
-    ('/task/send_finish_email', SendFinishEmail)
+    ('/tasks/send_reminders', SendReminders),
+    (outbox.DRAIN_URL, DrainOutbox),
+    ('/tasks/update_leaderboard', UpdateLeaderboard),
+    (tournament.ROUND_URL, CreateTournamentRound),
+    ('/tasks/advance_tournament', AdvanceTournament),
+    ('/crons/match_players', MatchPlayersCron),
+    (matchmaking.WORKER_URL, MatchPlayers),
+    (stats.AGGREGATE_URL, AggregateGame),
+    (stats.BACKFILL_URL, BackfillStats),
+    ('/crons/archive_games', ArchiveGamesCron),
+    (archive.WORKER_URL, ArchiveGames),
+    ('/tasks/migrate_games', MigrateGames),
+    ('/tasks/reserve_players', ReservePlayers),
+    ('/tasks/reindex_active_games', ReindexActiveGames),
+    ('/tasks/migrate_stats', MigrateStats)
 ], debug=True)
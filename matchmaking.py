@@ -0,0 +1,155 @@
+"""matchmaking.py - Pairs the players waiting for a game by rating.
+
+join_matchmaking writes a QueueEntry per waiting player, with their Elo rating
+(see Rating in models.py). The entries are the Datastore snapshot of the
+queue: pairing works on a MatchQueue (matchqueue.py), the in-memory list of
+the waiting players sorted by rating, loaded from all the entries when an instance starts (and
+every RELOAD_INTERVAL seconds) and topped up with the entries that joined
+since the last run in between.
+
+Pairing runs in a chain of tasks on the matchmaking queue, which runs one task
+at a time. Each run pairs the waiting players and creates the games in
+transactions of a few pairs, each deleting the entries of the paired players
+and adding the games to their active games. Players who already have a game
+in session together keep waiting, like those whose oppoent left."""
+
+import time
+
+from google.appengine.api import taskqueue
+from google.appengine.ext import ndb
+
+from matchqueue import MatchQueue
+from models import Player, Game, ActiveGames, Rating
+
+QUEUE_NAME = 'matchmaking'
+WORKER_URL = '/tasks/match_players'
+MATCH_INTERVAL = 5
+# Entries joining this long before the last run may not have been visible
+SYNC_OVERLAP = 30
+RELOAD_INTERVAL = 600
+# Two entries, the game and two active games per pair: 25 entity groups
+PAIRS_PER_TRANSACTION = 5
+
+
+class QueueEntry(ndb.Model):
+    """A player waiting for a game, keyed by the player's ID"""
+    player = ndb.KeyProperty(kind='Player', required=True, indexed=False)
+    rating = ndb.FloatProperty(required=True, indexed=False)
+    joined = ndb.FloatProperty(required=True)
+
+    @classmethod
+    def key_for(cls, player_key):
+        return ndb.Key(cls, player_key.id())
+
+
+# The instance's copy of the queue, the time it was loaded from all the
+# entries and the time of its last sync
+state = {'queue': MatchQueue(), 'loaded': None, 'synced': None}
+
+
+def join(player_key):
+    """Adds the player to the queue and makes sure pairing is running"""
+    rating = Rating.get_multi_for([player_key])[0]
+    QueueEntry(key=QueueEntry.key_for(player_key), player=player_key,
+               rating=rating.rating, joined=time.time()).put()
+    schedule()
+
+
+def leave(player_key):
+    """Removes the player from the queue"""
+    QueueEntry.key_for(player_key).delete()
+
+
+def schedule(countdown=0):
+    """Enqueues the next pairing run. Runs are named by time slot, so at
+    most one is enqueued per MATCH_INTERVAL"""
+    slot = int(time.time() + countdown) // MATCH_INTERVAL
+    try:
+        taskqueue.Queue(QUEUE_NAME).add(taskqueue.Task(
+            url=WORKER_URL, name='match-{}'.format(slot), countdown=countdown))
+    except (taskqueue.TaskAlreadyExistsError, taskqueue.TombstonedTaskError):
+        pass
+
+
+def sync(queue, since=None):
+    """Adds the entries that joined since the given time (all of them if
+    None) to the queue"""
+    query = QueueEntry.query()
+    if since is not None:
+        query = query.filter(QueueEntry.joined >= since - SYNC_OVERLAP)
+    for entry in query:
+        queue.add(entry.key.id(), entry.rating, entry.joined)
+
+
+def match():
+    """Pairs the waiting players and creates their games,
+    PAIRS_PER_TRANSACTION pairs per transaction. Returns the number of games
+    created"""
+    now = time.time()
+    if state['loaded'] is None or now - state['loaded'] > RELOAD_INTERVAL:
+        # Reloading drops the players who left
+        state['queue'] = MatchQueue()
+        sync(state['queue'])
+        state['loaded'] = now
+    else:
+        sync(state['queue'], state['synced'])
+    state['synced'] = now
+    queue = state['queue']
+    pairs = queue.pair(now)
+
+    created = 0
+    if pairs:
+        first, _ = Game.allocate_ids(len(pairs))
+        pairs = [(ndb.Key(Game, first + index), player, oppoent)
+                 for index, (player, oppoent) in enumerate(pairs)]
+        futures = [
+            _create_games_async(pairs[start:start + PAIRS_PER_TRANSACTION])
+            for start in range(0, len(pairs), PAIRS_PER_TRANSACTION)]
+        for future in futures:
+            games, waiting = future.get_result()
+            created += games
+            for entry in waiting:
+                queue.add(entry.key.id(), entry.rating, entry.joined)
+    if len(queue):
+        schedule(MATCH_INTERVAL)
+    return created
+
+
+@ndb.transactional_tasklet(xg=True)
+def _create_games_async(pairs):
+    """Creates the games of (game key, player ID, oppoent ID) pairs and
+    deletes the entries of their players, in the same transaction as the
+    players' active games. Leaves out the pairs of which a player left the
+    queue and those who have an active game together. Returns the number
+    of games created and the entries of the players who keep waiting"""
+    players = [player for _, host, oppoent in pairs
+               for player in (host, oppoent)]
+    entries, indexes = yield (
+        ndb.get_multi_async([ndb.Key(QueueEntry, player) for player in players]),
+        ActiveGames.get_multi_for_async([ndb.Key(Player, player)
+                                         for player in players]))
+    entries = dict(zip(players, entries))
+    indexes = dict(zip(players, indexes))
+    entities = []
+    matched = []
+    waiting = []
+    for key, player, oppoent in pairs:
+        host, guest = entries[player], entries[oppoent]
+        if not host or not guest:
+            # One of them left: the other one keeps waiting
+            waiting += [entry for entry in (host, guest) if entry]
+            continue
+        if guest.player in indexes[player].get_oppoents():
+            waiting += [host, guest]
+            continue
+        indexes[player].add(key, guest.player)
+        indexes[oppoent].add(key, host.player)
+        entities += [Game(key = key,
+                          host = host.player,
+                          oppoent = guest.player,
+                          next_turn = guest.player),
+                     indexes[player], indexes[oppoent]]
+        matched += [host.key, guest.key]
+    if matched:
+        yield ndb.put_multi_async(entities), ndb.delete_multi_async(matched)
+    raise ndb.Return(len(matched) // 2, waiting)
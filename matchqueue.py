@@ -0,0 +1,73 @@
+"""matchqueue.py - In-memory queue of the players waiting for a game, sorted
+by rating, see matchmaking.py.
+
+The players who have waited longest are paired first, each with the closest
+rated waiting player within a window that widens the longer they wait. The
+nearest player is found by bisection, so adding, removing and pairing a player
+take a few microseconds with tens of thousands of players waiting."""
+
+import bisect
+
+# Rating difference accepted right away, widened by WINDOW_GROWTH per second
+# of waiting up to MAX_WINDOW
+BASE_WINDOW = 50
+WINDOW_GROWTH = 10
+MAX_WINDOW = 400
+
+
+class MatchQueue(object):
+    """Waiting players sorted by rating. Entries are (rating, joined,
+    player ID) tuples"""
+
+    def __init__(self):
+        self._entries = []
+        self._players = {}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, player):
+        return player in self._players
+
+    def add(self, player, rating, joined):
+        """Adds a waiting player, unless already waiting"""
+        if player not in self._players:
+            entry = (rating, joined, player)
+            bisect.insort(self._entries, entry)
+            self._players[player] = entry
+
+    def remove(self, player):
+        """Removes a player if waiting"""
+        entry = self._players.pop(player, None)
+        if entry:
+            del self._entries[bisect.bisect_left(self._entries, entry)]
+
+    def nearest(self, player, window):
+        """Returns the waiting player rated closest to the player, if within
+        window, or None"""
+        entry = self._players[player]
+        index = bisect.bisect_left(self._entries, entry)
+        best = None
+        for other in self._entries[max(0, index - 1):index + 2]:
+            difference = abs(other[0] - entry[0])
+            if other is not entry and difference <= window and (
+                    best is None or difference < best[0]):
+                best = difference, other[2]
+        return best[1] if best else None
+
+    def pair(self, now):
+        """Removes and returns the (player, oppoent) pairs that can be made,
+        the longest waiting players first"""
+        pairs = []
+        for _, joined, player in sorted(self._players.values(),
+                                        key=lambda entry: entry[1]):
+            if player not in self._players:
+                continue
+            window = min(BASE_WINDOW + WINDOW_GROWTH * (now - joined),
+                         MAX_WINDOW)
+            oppoent = self.nearest(player, window)
+            if oppoent is not None:
+                self.remove(player)
+                self.remove(oppoent)
+                pairs.append((player, oppoent))
+        return pairs
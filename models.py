@@ -2,155 +2,711 @@
 entities used by the Game. Because these classes are also regular Python
 classes they can include methods (such as 'to_form' and 'new_game')."""
 
+import pickle
 import random
 from datetime import datetime
+from google.appengine.api import taskqueue
 from google.appengine.ext import ndb
 from forms import UserForm, GameForm, ScoreForm
 from utils import pretty_date
+import ai
+import cache
+import codec
+import counters
+import engine
+import symmetry
+from lru import LRUCache
+
+# Entity groups of a cross-group transaction
+MAX_GROUPS = 25
+INITIAL_RATING = 1500.0
+RATING_K = 32
+
+# Player keys by ('name', name) and ('email', email), see PlayerName
+PLAYER_KEYS_CACHE_SIZE = 10000
+player_keys = LRUCache(PLAYER_KEYS_CACHE_SIZE)
+# The AI Players by level. They never change: read once per instance
+ai_players = {}
+
+
+@ndb.non_transactional
+def allocate_ids_async(model, size):
+    """Like model.allocate_ids_async, also from a transaction, whose
+    connection cannot allocate IDs"""
+    return model.allocate_ids_async(size)
 
 
 class GameState:
     """Enumeration for the status of a game."""
-    Active, Completed= range(2)
+    Active, Completed= range(2)
 
 class GameResult:
-     """Enumeration for the status of a game of individual player."""
+    """Enumeration for the status of a game of individual player."""
     Won, Tied, Lost, Forfeit = range(4)
 
+class GameInSessionError(Exception):
+    """Raised when creating a game between 2 players who already have an
+    active game together"""
+
+class PlayerExistsError(Exception):
+    """Raised when creating a player whose name or email is taken"""
+
 class Player(ndb.Model):
-    """User profile"""
+    """User profile. The number of games won and played are kept in sharded
+    counters, see counters.py"""
     name = ndb.StringProperty(required=True)
     email = ndb.StringProperty(required=True)
-    won = ndb.IntegerProperty(default=0)
-    played = ndb.IntegerProperty(default=0)
+
+    # Stats stored on the Player before the counters, see migrate_stats_by_key
+    LEGACY_STATS = ('won', 'played')
 
     @staticmethod
-    """Get the win rate of the player"""
-    def get_win_rate(self):
-        if self.played > 0:
-            return (float(self.won) / float(self.played)) * 100
+    def stat_name(player_key, stat):
+        """Returns the counter name of a player's stat (won or played)"""
+        return 'player:{}:{}'.format(player_key.id(), stat)
+
+    @classmethod
+    def get_stats_multi(cls, player_keys):
+        """Returns the (won, played) of each player, reading the counters of
+        all players at once"""
+        names = []
+        for key in player_keys:
+            names.append(cls.stat_name(key, 'won'))
+            names.append(cls.stat_name(key, 'played'))
+        counts = counters.get_counts(names)
+        return [(counts[names[index]], counts[names[index + 1]])
+                for index in range(0, len(names), 2)]
+
+    def get_stats(self):
+        """Returns the number of games won and played"""
+        return Player.get_stats_multi([self.key])[0]
+
+    @staticmethod
+    def win_rate(won, played):
+        """Get the win rate from the number of games won and played"""
+        if played > 0:
+            return (float(won) / float(played)) * 100
         else:
             return 0
 
-    @classmethod
-    def to_form(self):
+    def get_win_rate(self):
+        """Get the win rate of the player"""
+        return Player.win_rate(*self.get_stats())
+
+    def to_form(self, stats=None):
+        """Returns a UserForm representation of the Player. Pass the
+        (won, played) of the player if already read"""
+        won, played = stats or self.get_stats()
         return UserForm(name = self.name,
             email = self.email,
-            won = self.won,
-            played = self.played)
+            won = won,
+            played = played)
+
+    @classmethod
+    @ndb.transactional(xg=True)
+    def create(cls, name, email):
+        """Creates and returns a player, reserving their name and email in
+        the same transaction. Raises PlayerExistsError if either is taken"""
+        name_key, email_key = PlayerName.key_for(name), PlayerEmail.key_for(email)
+        taken_name, taken_email = ndb.get_multi([name_key, email_key])
+        if taken_name:
+            raise PlayerExistsError('A Player with that name already exists!')
+        if taken_email:
+            raise PlayerExistsError('A Player with that email already exists!')
+        player = Player(id = allocate_ids_async(cls, 1).get_result()[0],
+                        name = name, email = email)
+        ndb.put_multi([player,
+                       PlayerName(key = name_key, player = player.key),
+                       PlayerEmail(key = email_key, player = player.key)])
+        return player
+
+    @classmethod
+    @ndb.transactional(xg=True)
+    def migrate_stats_by_key(cls, key):
+        """Adds the won and played stored on the player before the counters
+        existed to its counters and drops them, in one transaction so that
+        they are added once. Returns False if there was nothing to move"""
+        player = key.get()
+        legacy = [name for name in cls.LEGACY_STATS
+                  if player and name in player._properties]
+        if not legacy:
+            return False
+        deltas = {}
+        for name in legacy:
+            value = player._properties[name]._get_value(player)
+            if value:
+                deltas[cls.stat_name(key, name)] = value
+            # Unknown properties are loaded into the instance's own copy
+            del player._properties[name]
+            player._values.pop(name, None)
+        ndb.put_multi([player] + counters.increments(deltas))
+        return True
 
+    def reserve(self):
+        """Reserves the player's name and email if they are not taken yet,
+        for the players created before reservations existed"""
+        PlayerName.get_or_insert(self.name, player = self.key)
+        PlayerEmail.get_or_insert(self.email, player = self.key)
+
+    @classmethod
+    def get_players_by_name(cls, names):
+        """Returns the player of each name, or None, reading the
+        reservations that are not cached and the players in one batch
+        each"""
+        return cls.get_players_by_name_async(names).get_result()
+
+    @classmethod
+    def get_players_by_name_async(cls, names):
+        """Like get_players_by_name, returns a future"""
+        return cls._get_players_async(PlayerName, 'name', names)
+
+    @classmethod
     def get_player_by_name(cls, name):
-        return Player.query(Player.name = name).get()
+        return cls.get_player_by_name_async(name).get_result()
 
+    @classmethod
+    @ndb.tasklet
+    def get_player_by_name_async(cls, name):
+        players = yield cls.get_players_by_name_async([name])
+        raise ndb.Return(players[0])
+
+    @classmethod
     def get_player_by_email(cls, email):
-        return Player.query(Player.email = email).get()
-
-    def add_won(self):
-    """Adds to the to total number of game won"""
-        self.won += 1
-        self.put()
-
-    def add_played(self):
-    """Adds to the total number of game played"""
-        self.played += 1
-        self.put()
-
-class Game(ndb.Model):
-    """Game object"""
-    host = KeyProperty(kind='Player', required=True)
-    host_moves = PickleProperty(default=[], required=True)
-    oppoent = KeyProperty(kind='Player', required=True)
-    oppoent_moves = PickleProperty(default=[], required=True)
-    next_turn = KeyProperty(kind='Player', required=True)
-    setup = ndb.PickleProperty(required=True)
+        return cls._get_players_async(PlayerEmail, 'email',
+                                      [email]).get_result()[0]
+
+    @staticmethod
+    @ndb.tasklet
+    def _get_players_async(reservation, field, values):
+        keys = [player_keys.get((field, value)) if value else None
+                for value in values]
+        missing = [index for index, key in enumerate(keys)
+                   if key is None and values[index]]
+        if missing:
+            reservations = yield ndb.get_multi_async(
+                [reservation.key_for(values[index]) for index in missing])
+            for index, found in zip(missing, reservations):
+                if found:
+                    # Reservations never change: only misses are uncached
+                    keys[index] = found.player
+                    player_keys.put((field, values[index]), found.player)
+        found = [key for key in keys if key]
+        players = iter((yield ndb.get_multi_async(found)) if found else [])
+        raise ndb.Return([next(players) if key else None for key in keys])
+
+    @classmethod
+    def get_ai_player(cls, level):
+        """Returns the Player standing for the AI at a difficulty level"""
+        return cls.get_ai_player_async(level).get_result()
+
+    @classmethod
+    @ndb.non_transactional
+    @ndb.tasklet
+    def get_ai_player_async(cls, level):
+        """Like get_ai_player, returns a future. Read outside of any
+        transaction, so that the AI never adds an entity group to one"""
+        if ai_players.get(level) is None:
+            ai_players[level] = yield Player.get_or_insert_async(
+                'ai-' + level, name='AI ({})'.format(level),
+                email='noreply@tictactoe.ai')
+        raise ndb.Return(ai_players[level])
+
+    @classmethod
+    @ndb.non_transactional
+    @ndb.tasklet
+    def get_ai_players_async(cls):
+        """Returns a future of the AI Players by level, None for a level not
+        created yet, read with one get_multi outside of any transaction. The
+        levels are only read once per instance"""
+        missing = [level for level in ai.LEVELS if level not in ai_players]
+        if missing:
+            players = yield ndb.get_multi_async(
+                [ndb.Key(Player, 'ai-' + level) for level in missing])
+            for level, player in zip(missing, players):
+                ai_players.setdefault(level, player)
+        raise ndb.Return(dict(ai_players))
+
+class PlayerName(ndb.Model):
+    """Reservation of a player name, keyed by the name. Makes names unique
+    and the player of a name a strongly consistent get"""
+    player = ndb.KeyProperty(kind='Player', required=True, indexed=False)
+
+    @classmethod
+    def key_for(cls, name):
+        return ndb.Key(cls, name)
+class PlayerEmail(PlayerName):
+    """Reservation of a player email, keyed by the email"""
+
+class Game(cache.CachedModel):
+    """Game object. Each player's moves are stored as a 9-bit integer,
+    see engine.py, and the sequence of moves packed in a blob, see codec.py.
+    position is the symmetry class ID of the current board and opening the
+    one after the first move, see symmetry.py"""
+    host = ndb.KeyProperty(kind='Player', required=True)
+    host_board = ndb.IntegerProperty(default=0, indexed=False)
+    oppoent = ndb.KeyProperty(kind='Player', required=True)
+    oppoent_board = ndb.IntegerProperty(default=0, indexed=False)
+    next_turn = ndb.KeyProperty(kind='Player', required=True)
+    position = ndb.IntegerProperty(default=0)
+    position_transform = ndb.IntegerProperty(default=0, indexed=False)
+    opening = ndb.IntegerProperty()
+    ai_level = ndb.StringProperty(indexed=False)
     status = ndb.IntegerProperty(default=GameState.Active, required=True)
-    history = ndb.PickleProperty(default=[], required=True)
-    start_date = ndb.DateTimeProperty(auto_now_add=True)
+    moves = ndb.BlobProperty(default=codec.EMPTY)
+    start_date = ndb.DateTimeProperty(auto_now_add=True)
+    tournament = ndb.KeyProperty(kind='Tournament', indexed=False)
+    round = ndb.IntegerProperty(indexed=False)
+
+    # Pickled lists of the games stored before the moves were packed
+    LEGACY_PROPERTIES = ('setup', 'host_moves', 'oppoent_moves', 'history')
 
     @classmethod
-    def new_game(cls, host, oppoent):
+    @ndb.transactional(xg=True)
+    def new_game(cls, host, oppoent, ai_level=None):
         """Creates and returns a new game
-        Oppoent will go first, host goes last"""
-        game = Game(host = host,
-                    oppoent = oppoent)
-
-        setup = range(1, 10)
-        game.setup = setup
-        game.next_turn = self.oppoent
-        game.put()
+        Oppoent will go first, host goes last. In a single-player game the
+        oppoent is the AI at ai_level and plays its first move right away.
+        The game is added to the players' active games in the same
+        transaction. Raises GameInSessionError if the players already have
+        an active game together"""
+        # The ID is allocated while the active games are read
+        ids = allocate_ids_async(cls, 1)
+        players = [host] if ai_level else [host, oppoent]
+        indexes = ActiveGames.get_multi_for(players)
+        if oppoent in indexes[0].get_oppoents():
+            raise GameInSessionError('A game is currently in session!')
+
+        game = Game(id = ids.get_result()[0],
+                    host = host,
+                    oppoent = oppoent,
+                    next_turn = oppoent,
+                    ai_level = ai_level)
+        if ai_level:
+            game.play_ai_move()
+        for index, other in zip(indexes, [oppoent, host]):
+            index.add(game.key, other)
+        ndb.put_multi([game] + indexes)
         return game
 
+    @staticmethod
+    def round_counter(tournament_key, number):
+        """Returns the counter name of the finished games of a tournament
+        round, see tournament.py"""
+        return 'tournament:{}:round:{}'.format(tournament_key.id(), number)
+
+    @property
+    def setup(self):
+        """The positions (1-9) still available on the board"""
+        return list(engine.legal_moves(self.host_board, self.oppoent_board))
+
     def check_player(self, player):
         """Check if the player is in the game"""
-        return player == self.host.key or player == self.oppoent.key
+        return player.key == self.host or player.key == self.oppoent
 
     def check_player_turn(self, player):
-        return player == self.next_turn.key
+        return player.key == self.next_turn
 
     def is_host(self, player):
-        return player == self.host.key
+        return player.key == self.host
 
     def is_oppoent(self, player):
-        return player == self.oppoent.key
+        return player.key == self.oppoent
+
+    def is_available(self, move):
+        """Check if the move is on the board and not already taken"""
+        return engine.is_legal(self.host_board, self.oppoent_board, move)
+
+    def add_move(self, player, move):
+        """Marks the position for the player and passes the turn to the
+        other player. Returns True if the move wins the game"""
+        side = codec.HOST if self.is_host(player) else codec.OPPOENT
+        self.moves = codec.append(self.moves, side, move)
+        if self.is_host(player):
+            self.host_board |= engine.bit(move)
+            self.next_turn = self.oppoent
+            won = engine.is_winner(self.host_board)
+        else:
+            self.oppoent_board |= engine.bit(move)
+            self.next_turn = self.host
+            won = engine.is_winner(self.oppoent_board)
+        # The oppoent always goes first
+        self.position, self.position_transform = symmetry.canonical(
+            self.oppoent_board, self.host_board)
+        if self.opening is None:
+            self.opening = self.position
+        return won
+
+    @property
+    def plies(self):
+        """The moves as (side, position) pairs, side being codec.HOST or
+        codec.OPPOENT"""
+        return codec.decode(self.moves)
 
-    def to_form(self):
-        """Returns a GameForm representation of the Game"""
+    def get_history(self):
+        """Returns the moves as [player name, position] pairs"""
+        host, oppoent = ndb.get_multi([self.host, self.oppoent])
+        names = {codec.HOST: host.name, codec.OPPOENT: oppoent.name}
+        return [[names[side], move] for side, move in self.plies]
+
+    def has_legacy_properties(self):
+        """Check if the game was stored with the legacy pickled lists"""
+        return any(name in self._properties for name in self.LEGACY_PROPERTIES)
+
+    def migrate(self):
+        """Converts the legacy pickled history to the packed moves, rebuilds
+        the boards and positions from the moves and drops the legacy
+        properties. Returns False if there was nothing to convert"""
+        legacy = [name for name in self.LEGACY_PROPERTIES
+                  if name in self._properties]
+        if not legacy:
+            return False
+        plies = []
+        if 'history' in legacy:
+            raw = self._properties['history']._get_value(self)
+            # Turns alternate and the oppoent goes first
+            plies = [(codec.HOST if index % 2 else codec.OPPOENT, move)
+                     for index, (_, move) in
+                     enumerate(pickle.loads(raw) if raw else [])]
+        # Moves played since the new layout was deployed come last
+        plies += self.plies
+        self.moves = codec.encode(plies)
+        self.host_board, self.oppoent_board = codec.boards(self.moves)
+        self.position, self.position_transform = symmetry.canonical(
+            self.oppoent_board, self.host_board)
+        self.opening = None
+        if plies:
+            self.opening = symmetry.canonical(engine.bit(plies[0][1]), 0)[0]
+        for name in legacy:
+            # Unknown properties are loaded into the instance's own copy
+            del self._properties[name]
+            self._values.pop(name, None)
+        return True
+
+    @classmethod
+    @ndb.transactional
+    def migrate_by_key(cls, key):
+        """Migrates and puts the game if it has legacy properties"""
+        game = key.get()
+        if game and game.migrate():
+            game.put()
+
+    def is_ai(self, player_key):
+        """Check if the player is the AI of a single-player game"""
+        return bool(self.ai_level) and player_key == self.oppoent
+
+    def play_ai_move(self, player=None):
+        """Plays the AI's move in a single-player game. The AI is always the
+        oppoent. Pass the AI Player if read already. Returns the AI Player,
+        the position (1-9) it played and True if the move wins the game"""
+        player = player or Player.get_ai_player(self.ai_level)
+        move = ai.choose_move(self.oppoent_board, self.host_board,
+                              self.ai_level)
+        return player, move, self.add_move(player, move)
+
+    def is_full(self):
+        """Check if no position is left on the board"""
+        return engine.is_full(self.host_board, self.oppoent_board)
+
+    @ndb.non_transactional
+    @ndb.tasklet
+    def get_players_async(self):
+        """Reads the host and the oppoent, outside of any transaction.
+        Returns a future of the dictionary of Player key to Player that
+        to_form takes"""
+        keys = [self.host, self.oppoent]
+        players = yield ndb.get_multi_async(keys)
+        raise ndb.Return(dict(zip(keys, players)))
+
+    def to_form(self, message, players=None):
+        """Returns a GameForm representation of the Game. Pass a dictionary
+        of Player key to Player holding both players if already read"""
         status_list = ['Active', 'Completed']
         status = status_list[self.status]
         date_start = pretty_date(self.start_date)
+        if players:
+            host, oppoent = players[self.host], players[self.oppoent]
+        else:
+            host, oppoent = ndb.get_multi([self.host, self.oppoent])
+        if self.next_turn == self.host:
+            next_turn = host
+        else:
+            next_turn = oppoent
         form = GameForm(urlsafe_key = self.key.urlsafe(),
             setup = str(self.setup),
-            host_name = self.host,
-            oppoent_name = self.oppoent,
-            turn = self.turn.get().name,
+            host_name = host.name,
+            oppoent_name = oppoent.name,
+            next_turn = next_turn.name,
             status = status,
-            start_date = date_start)
+            start_date = date_start,
+            message = message)
         return form
 
     def end_game(self, player=None, forfeit=False):
         """Ends the game - if won is True, the player won. - if won is False,
-        the player lost."""
+        the player lost. Nothing is written: returns the Game, its Score and
+        the players' counter shards and active games for the caller to put in
+        a single batch from a transaction, and the tasks to enqueue with it
+        (see outbox.post_async): the leaderboard update (which also updates the
+        ratings of a two-player game) and statistics tasks, and the round
+        advancement task of a tournament game."""
         self.status = GameState.Completed
-        self.put()
+        # The AI of a single-player game has no statistics
+        players = [key for key in (self.host, self.oppoent)
+                   if not self.is_ai(key)]
+        stats = dict((Player.stat_name(key, 'played'), 1) for key in players)
+        winner = None
         if player:
-            if not forfeit:
-                if self.is_host(player):
-                    score = Score(game = self.key, host=self.host, host_result = GameResult.Won,
-                    oppoent = self.oppoent, oppoent_result = GameResult.Lost)
-                else self.is_oppoent(player):
-                    score = Score(game = self.key, host=self.host, host_result = GameResult.Lost,
-                    oppoent = self.oppoent, oppoent_result = GameResult.Won)
+            # The player won, unless they forfeited
+            if self.is_host(player) != forfeit:
+                winner = self.host
+                host_result, oppoent_result = GameResult.Won, GameResult.Lost
             else:
-                if self.is_host(player):
-                    score = Score(game = self.key, host=self.host, host_result = GameResult.Lost,
-                    oppoent = self.oppoent, oppoent_result = GameResult.Won)
-                else self.is_oppoent(player):
-                    score = Score(game = self.key, host=self.host, host_result = GameResult.Won,
-                    oppoent = self.oppoent, oppoent_result = GameResult.Lost)
+                winner = self.oppoent
+                host_result, oppoent_result = GameResult.Lost, GameResult.Won
         else:
-            score = Score(game = self.key, host=self.host, host_result = GameResult.Tied,
-            oppoent = self.oppoent, oppoent_result = GameResult.Tied)
-        score.put()
+            host_result, oppoent_result = GameResult.Tied, GameResult.Tied
+        if winner in players:
+            stats[Player.stat_name(winner, 'won')] = 1
+        score = Score(key = Score.key_for(self.key),
+                      game = self.key,
+                      host = self.host, host_result = host_result,
+                      oppoent = self.oppoent, oppoent_result = oppoent_result)
+        params = {'user_key': [key.urlsafe() for key in players]}
+        if not self.ai_level:
+            # The ratings are updated by the task, out of this transaction
+            params['game_key'] = self.key.urlsafe()
+        tasks = [taskqueue.Task(url='/tasks/update_leaderboard',
+                                params=params),
+                 taskqueue.Task(url='/tasks/aggregate_game',
+                                params={'game_key': self.key.urlsafe()})]
+        if self.tournament:
+            stats[Game.round_counter(self.tournament, self.round)] = 1
+            tasks.append(taskqueue.Task(
+                url='/tasks/advance_tournament',
+                params={'tournament_key': self.tournament.urlsafe(),
+                        'round': self.round}))
+        indexes = ActiveGames.get_multi_for(players)
+        for index in indexes:
+            index.remove(self.key)
+        return [self, score] + counters.increments(stats) + indexes, tasks
+
+class ActiveGames(ndb.Model):
+    """Keys of the active games of a (human) player, keyed by the player's
+    ID, and the other player of each game, so that new_game can check for a
+    game in session without reading the games. Maintained by new_game and
+    end_game. The reminders page through the players with active games on
+    the has_active equality filter, whose results are in key order and do
+    not move when a player's number of games changes"""
+    games = ndb.KeyProperty(kind='Game', repeated=True, indexed=False)
+    oppoents = ndb.KeyProperty(kind='Player', repeated=True, indexed=False)
+    has_active = ndb.ComputedProperty(lambda self: bool(self.games))
+
+    @classmethod
+    def key_for(cls, player_key):
+        return ndb.Key(cls, player_key.id())
+
+    @classmethod
+    @ndb.transactional
+    def reindex_by_key(cls, key):
+        """Puts the index again, storing has_active for the indexes written
+        before it existed"""
+        index = key.get()
+        if index:
+            index.put()
+
+    @property
+    def player(self):
+        """The key of the Player"""
+        return ndb.Key(Player, self.key.id())
+
+    def add(self, game_key, oppoent_key):
+        if game_key not in self.games:
+            self.oppoents = self.get_oppoents() + [oppoent_key]
+            self.games.append(game_key)
+
+    def remove(self, game_key):
+        if game_key in self.games:
+            oppoents = self.get_oppoents()
+            index = self.games.index(game_key)
+            del self.games[index]
+            del oppoents[index]
+            self.oppoents = oppoents
+
+    def get_oppoents(self):
+        """Returns the other player of each game. The games added before
+        the other players were stored are read, outside of any transaction:
+        the players of a game never change"""
+        if len(self.oppoents) == len(self.games):
+            return list(self.oppoents)
+        player = self.player
+        return [(game.oppoent if game.host == player else game.host)
+                if game else None for game in _get_games(self.games)]
+
+    @classmethod
+    def get_multi_for(cls, player_keys):
+        """Returns the active games of the players, empty for players
+        without any"""
+        return cls.get_multi_for_async(player_keys).get_result()
+
+    @classmethod
+    @ndb.tasklet
+    def get_multi_for_async(cls, player_keys):
+        """Like get_multi_for, returns a future"""
+        keys = [cls.key_for(key) for key in player_keys]
+        indexes = yield ndb.get_multi_async(keys)
+        raise ndb.Return([index or cls(key=key)
+                          for key, index in zip(keys, indexes)])
+
+    @classmethod
+    def add_games(cls, games_by_player):
+        """Adds games to the active games of many players, a dictionary of
+        Player key to (game key, other player key) pairs, MAX_GROUPS players
+        per transaction. Safe to run more than once"""
+        player_keys = list(games_by_player)
+        for start in range(0, len(player_keys), MAX_GROUPS):
+            cls._add_games(dict((key, games_by_player[key])
+                                for key in player_keys[start:start + MAX_GROUPS]))
+
+    @classmethod
+    @ndb.transactional(xg=True)
+    def _add_games(cls, games_by_player):
+        indexes = cls.get_multi_for(list(games_by_player))
+        for index in indexes:
+            for game_key, oppoent_key in games_by_player[index.player]:
+                index.add(game_key, oppoent_key)
+        ndb.put_multi(indexes)
+
+@ndb.non_transactional
+def _get_games(game_keys):
+    return ndb.get_multi(game_keys)
+
+class Rating(ndb.Model):
+    """Elo rating of a (human) player, keyed by the player's ID. Updated by
+    the leaderboard task end_game enqueues, see apply"""
+    rating = ndb.FloatProperty(default=INITIAL_RATING, indexed=False)
+    games = ndb.IntegerProperty(default=0, indexed=False)
+
+    @classmethod
+    def key_for(cls, player_key):
+        return ndb.Key(cls, player_key.id())
+
+    @classmethod
+    def get_multi_for(cls, player_keys):
+        """Returns the ratings of the players, the initial rating for players
+        without one"""
+        keys = [cls.key_for(key) for key in player_keys]
+        return [rating or cls(key=key)
+                for key, rating in zip(keys, ndb.get_multi(keys))]
+
+    @staticmethod
+    def expected(rating, other):
+        """Returns the expected score (1 for a win, 0.5 for a tie) of a player
+        rated rating against a player rated other"""
+        return 1 / (1 + 10 ** ((other - rating) / 400.0))
+
+    @classmethod
+    def update(cls, ratings, host_result):
+        """Updates the (host, oppoent) ratings with the result of the host"""
+        host, oppoent = ratings
+        score = {GameResult.Won: 1.0, GameResult.Tied: 0.5}.get(host_result, 0.0)
+        change = RATING_K * (score - cls.expected(host.rating, oppoent.rating))
+        host.rating += change
+        oppoent.rating -= change
+        host.games += 1
+        oppoent.games += 1
+
+    @classmethod
+    @ndb.transactional(xg=True)
+    def apply(cls, game_key):
+        """Updates the ratings of the players of a completed two-player game
+        with its result, once. Returns False if it was applied already or
+        the game has no Score"""
+        marker_key = Rated.key_for(game_key)
+        score, marker = ndb.get_multi([Score.key_for(game_key), marker_key])
+        if marker or not score:
+            return False
+        ratings = cls.get_multi_for([score.host, score.oppoent])
+        cls.update(ratings, score.host_result)
+        ndb.put_multi(ratings + [Rated(key=marker_key)])
+        return True
+
+class Rated(ndb.Model):
+    """Marks a game as applied to the ratings. Child of the Game"""
+
+    @classmethod
+    def key_for(cls, game_key):
+        return ndb.Key(cls, 1, parent=game_key)
 
 class Score(ndb.Model):
-    """Score object"""
+    """Score object. Child of its Game so that it is written in the same
+    entity group"""
     game = ndb.KeyProperty(kind='Game', required=True)
     host = ndb.KeyProperty(kind='Player', required=True)
     host_result = ndb.IntegerProperty(required=True)
     oppoent = ndb.KeyProperty(kind='Player', required=True)
     oppoent_result = ndb.IntegerProperty(required=True)
     end_date = ndb.DateTimeProperty(auto_now_add=True)
+    # Packed moves of an archived game, whose Game was deleted, see archive.py
+    moves = ndb.BlobProperty()
 
     @classmethod
-    def to_form(self):
+    def key_for(cls, game_key):
+        """Returns the key of the Score of a game"""
+        return ndb.Key(cls, 1, parent=game_key)
+
+    @property
+    def archived(self):
+        return self.moves is not None
+
+    @property
+    def plies(self):
+        """The moves of an archived game, like Game.plies"""
+        return codec.decode(self.moves)
+
+    def get_history(self):
+        """Returns the moves of an archived game as [player name, position]
+        pairs, like Game.get_history"""
+        names = Score.get_names([self])
+        players = {codec.HOST: names[self.host],
+                   codec.OPPOENT: names[self.oppoent]}
+        return [[players[side], move] for side, move in self.plies]
+
+    def to_form(self, names=None):
+        """Returns a ScoreForm representation of the Score. names maps
+        Player keys to names already read, see to_forms"""
+        if names is None:
+            names = Score.get_names([self])
         status_list = ['Won', 'Tied', 'Lost', 'Forfeit']
         host_status = status_list[self.host_result]
         oppoent_status = status_list[self.oppoent_result]
         date_end = pretty_date(self.end_date)
 
-        return ScoreForm(host_name = self.host.get().name,
+        return ScoreForm(host_name = names[self.host],
             host_result = host_status,
-            oppoent_name = self.oppoent.get().name,
+            oppoent_name = names[self.oppoent],
             oppoent_result = oppoent_status,
             end_date = date_end,
             game = self.game.urlsafe())
+
+    @staticmethod
+    def get_names(scores, names=None):
+        """Returns a dictionary of Player key to name for every player of
+        the scores, reading the players not in names with one get_multi.
+        names is updated in place so it can be shared across calls"""
+        if names is None:
+            names = {}
+        keys = set()
+        for score in scores:
+            keys.add(score.host)
+            keys.add(score.oppoent)
+        missing = [key for key in keys if key not in names]
+        for key, player in zip(missing, ndb.get_multi(missing)):
+            names[key] = player.name if player else ''
+        return names
+
+    @classmethod
+    def to_forms(cls, scores, names=None):
+        """Returns the ScoreForms of the scores, resolving all the players'
+        names at once"""
+        names = cls.get_names(scores, names)
+        return [score.to_form(names) for score in scores]
@@ -0,0 +1,150 @@
+"""outbox.py - Notification outbox for the game emails.
+
+Instead of enqueueing one mail task per email, make_move and forfeit_game
+post their notifications as OutboxEvent entities written in the same
+transaction as the game. The events are children of the Game, so they add
+no entity group to the transaction, and are keyed by kind and player, so a
+(player, game, kind) notification is only stored once however many times
+it is posted before being sent. A single drain task per transaction sends
+every pending event of the games written by the transaction, grouped into
+one email per player and game, then deletes them. It is added with the other
+tasks of the transaction (those of end_game) in one batched Queue.add call."""
+
+from google.appengine.api import taskqueue
+from google.appengine.ext import ndb
+
+from models import Player, GameState
+
+MOVE, FORFEIT, CONGRATS, FINISH = 'move', 'forfeit', 'congrats', 'finish'
+KINDS = (MOVE, FORFEIT, CONGRATS, FINISH)
+
+DRAIN_URL = '/tasks/drain_outbox'
+QUEUE_NAME = 'default'
+
+
+class OutboxEvent(ndb.Model):
+    """Pending notification of a player about a game. Child of the Game,
+    keyed by '<kind>:<player ID>'"""
+    kind = ndb.StringProperty(required=True, indexed=False)
+    player = ndb.KeyProperty(kind='Player', required=True, indexed=False)
+    created = ndb.DateTimeProperty(auto_now_add=True, indexed=False)
+
+
+def post_async(game_key, notifications, tasks=()):
+    """Returns the events of the notifications, (player key, kind) pairs,
+    for the caller to put, and the future enqueueing the drain task along with
+    the other tasks of the transaction in a single Queue.add, for the caller
+    to wait on alongside its put. Call from the transaction that puts the
+    events"""
+    return post_multi_async({game_key: notifications}, tasks)
+
+
+def post_multi(notifications, tasks=()):
+    """Like post_async for several games, notifications being a dictionary
+    of game key to (player key, kind) pairs, waiting for the tasks to be
+    enqueued. A single drain task is enqueued for all the games"""
+    events, enqueued = post_multi_async(notifications, tasks)
+    enqueued.get_result()
+    return events
+
+
+def post_multi_async(notifications, tasks=()):
+    """Like post_multi, returns the events and the future of the tasks
+    being enqueued"""
+    events = {}
+    for game_key, game_notifications in notifications.items():
+        for player_key, kind in game_notifications:
+            event_id = '{}:{}'.format(kind, player_key.id())
+            events[game_key, event_id] = OutboxEvent(
+                id=event_id, parent=game_key, kind=kind, player=player_key)
+    tasks = list(tasks)
+    if events:
+        game_keys = set(game_key for game_key, _ in events)
+        tasks.append(taskqueue.Task(url=DRAIN_URL, params={
+            'game_key': [key.urlsafe() for key in game_keys]}))
+    return list(events.values()), _add_async(tasks, ndb.in_transaction())
+
+
+@ndb.tasklet
+def _add_async(tasks, transactional):
+    """Enqueues the tasks with a single Queue.add RPC, wrapped in a future
+    so that it can be yielded along with other futures"""
+    if not tasks:
+        raise ndb.Return([])
+    added = yield taskqueue.Queue(QUEUE_NAME).add_async(
+        tasks, transactional=transactional)
+    raise ndb.Return(added)
+
+
+def compose(kind, player, game_key, stats=None):
+    """Returns the (subject, body) of a notification. stats is the
+    (won, played) of the player, needed for CONGRATS"""
+    if kind == MOVE:
+        return ('A Tic-Tac-Toe Game - It\'s your turn!',
+                'Hi {}, Your oppoent has made a move! Now it\'s your turn to '
+                'play. The game key is: {}'.format(player.name,
+                                                   game_key.urlsafe()))
+    if kind == FORFEIT:
+        return ('A Tic-Tac-Toe Game - Your oppoent has surrendered!',
+                'Hi {}, Your oppoent has surrendered! The game key is: {}'
+                .format(player.name, game_key.urlsafe()))
+    if kind == CONGRATS:
+        won, played = stats
+        return ('Congratulations',
+                'Congratulations {}, for completing the game {}. '
+                'You have won {} game(s). Your win rate is {}%. '
+                'Keep it up!'.format(player.name, game_key.urlsafe(), won,
+                                     Player.win_rate(won, played)))
+    if kind == FINISH:
+        return ('It\'s a tie!',
+                'The game {} has tied! Thank you for playing!'.format(
+                    game_key.urlsafe()))
+    raise ValueError('Unknown notification kind: {}'.format(kind))
+
+
+def drain(game_key, send_mail, sender):
+    """Sends the pending events of the game, one email per player, with
+    send_mail(sender, to, subject, body) and deletes them. The move events
+    of a completed game are deleted without being sent. Returns the number
+    of emails sent"""
+    events = OutboxEvent.query(ancestor=game_key).fetch()
+    if not events:
+        return 0
+    player_keys = list(set(event.player for event in events))
+    entities = ndb.get_multi([game_key] + player_keys)
+    game, players = entities[0], entities[1:]
+    # A move notification is stale once the game has ended
+    stale = not game or game.status == GameState.Completed
+    by_player = dict((key, []) for key in player_keys)
+    for event in events:
+        if not (stale and event.kind == MOVE):
+            by_player[event.player].append(event.kind)
+    congratulated = [key for key in player_keys
+                     if CONGRATS in by_player[key]]
+    stats = dict(zip(congratulated, Player.get_stats_multi(congratulated)))
+
+    sent = 0
+    for key, player in zip(player_keys, players):
+        if not player or not player.email or not by_player[key]:
+            continue
+        kinds = sorted(by_player[key], key=KINDS.index)
+        messages = [compose(kind, player, game_key, stats.get(key))
+                    for kind in kinds]
+        if len(messages) == 1:
+            subject, body = messages[0]
+        else:
+            subject = 'A Tic-Tac-Toe Game - Game updates'
+            body = '\n\n'.join(message_body for _, message_body in messages)
+        send_mail(sender, player.email, subject, body)
+        sent += 1
+    _delete_sent(events)
+    return sent
+
+
+@ndb.transactional
+def _delete_sent(events):
+    """Deletes the events that were sent, unless they were posted again
+    since they were read"""
+    current = ndb.get_multi([event.key for event in events])
+    ndb.delete_multi([event.key for event, latest in zip(events, current)
+                      if latest and latest.created == event.created])
@@ -0,0 +1,186 @@
+"""profiling.py - Opt-in profiling of the endpoints and task handlers.
+
+Methods decorated with profiled are sampled at PROFILING_SAMPLE_RATE (an
+environment variable set in app.yaml, 0 by default, which turns profiling
+off). For a sampled call the wall time is measured and every API call it makes
+(datastore_v3.Get, memcache.Get, taskqueue.BulkAdd, ...) is counted by
+apiproxy hooks, along with the bytes of its request and response protocol
+buffers. The hooks only count the calls made from the thread of a sampled
+call, so concurrent requests of a threadsafe instance are not mixed up.
+
+Samples are added to per-method histograms kept in the memory of each
+instance, read by the get_profile endpoint. A call that is not sampled costs
+one random number."""
+
+import functools
+import os
+import random
+import threading
+import time
+
+from forms import ProfileForm, RpcCountForm
+
+SAMPLE_RATE = float(os.environ.get('PROFILING_SAMPLE_RATE', 0))
+# Upper bounds of the histogram buckets, the last bucket has none
+LATENCY_BOUNDS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+PAYLOAD_BOUNDS = (256, 1024, 4096, 16384, 65536, 262144, 1048576)
+
+_local = threading.local()
+_lock = threading.Lock()
+_profiles = {}
+_hooks_installed = []
+
+
+class Histogram(object):
+    """Counts the values falling in each bucket"""
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+
+    def add(self, value):
+        for index, bound in enumerate(self.bounds):
+            if value <= bound:
+                self.counts[index] += 1
+                return
+        self.counts[-1] += 1
+
+    def percentile(self, fraction):
+        """Returns the upper bound of the bucket holding the percentile, the
+        last bound if it is in the last bucket, 0 if there is no value"""
+        rank = fraction * sum(self.counts)
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if count and seen >= rank:
+                return self.bounds[min(index, len(self.bounds) - 1)]
+        return 0
+
+
+class Sample(object):
+    """The API calls of one sampled call and their payload bytes"""
+
+    def __init__(self):
+        self.rpcs = {}
+        self.request_bytes = 0
+        self.response_bytes = 0
+
+
+class Profile(object):
+    """Aggregated samples of a method"""
+
+    def __init__(self, name):
+        self.name = name
+        self.calls = 0
+        self.errors = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.latency = Histogram(LATENCY_BOUNDS_MS)
+        self.payload = Histogram(PAYLOAD_BOUNDS)
+        self.rpcs = {}
+        self.request_bytes = 0
+        self.response_bytes = 0
+
+    def add(self, elapsed_ms, sample, failed):
+        self.calls += 1
+        self.errors += failed
+        self.total_ms += elapsed_ms
+        self.max_ms = max(self.max_ms, elapsed_ms)
+        self.latency.add(elapsed_ms)
+        self.payload.add(sample.request_bytes + sample.response_bytes)
+        for rpc, count in sample.rpcs.items():
+            self.rpcs[rpc] = self.rpcs.get(rpc, 0) + count
+        self.request_bytes += sample.request_bytes
+        self.response_bytes += sample.response_bytes
+
+    def to_form(self):
+        return ProfileForm(name=self.name,
+                           calls=self.calls,
+                           errors=self.errors,
+                           mean_ms=self.total_ms / self.calls,
+                           max_ms=self.max_ms,
+                           p50_ms=self.latency.percentile(0.5),
+                           p99_ms=self.latency.percentile(0.99),
+                           latency_buckets=self.latency.counts,
+                           payload_buckets=self.payload.counts,
+                           rpcs=[RpcCountForm(rpc=rpc, count=count)
+                                 for rpc, count in sorted(self.rpcs.items())],
+                           request_bytes=self.request_bytes,
+                           response_bytes=self.response_bytes)
+
+
+def _byte_size(message):
+    size = getattr(message, 'ByteSize', None)
+    return size() if size else 0
+
+
+def _pre_call(service, call, request, response):
+    sample = getattr(_local, 'sample', None)
+    if sample is not None:
+        rpc = '{}.{}'.format(service, call)
+        sample.rpcs[rpc] = sample.rpcs.get(rpc, 0) + 1
+        sample.request_bytes += _byte_size(request)
+
+
+def _post_call(service, call, request, response):
+    sample = getattr(_local, 'sample', None)
+    if sample is not None:
+        sample.response_bytes += _byte_size(response)
+
+
+def _install_hooks():
+    """Appends the hooks to the API proxy, once per instance"""
+    from google.appengine.api import apiproxy_stub_map
+    with _lock:
+        if _hooks_installed:
+            return
+        apiproxy_stub_map.apiproxy.GetPreCallHooks().Append(
+            'profiling', _pre_call)
+        apiproxy_stub_map.apiproxy.GetPostCallHooks().Append(
+            'profiling', _post_call)
+        _hooks_installed.append(True)
+
+
+def profiled(method):
+    """Decorates an endpoint or a handler method, profiling a sample of its
+    calls under <class name>.<method name>"""
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        if SAMPLE_RATE <= 0 or random.random() >= SAMPLE_RATE or \
+                getattr(_local, 'sample', None) is not None:
+            return method(self, *args, **kwargs)
+        if not _hooks_installed:
+            _install_hooks()
+        sample = _local.sample = Sample()
+        failed = True
+        start = time.time()
+        try:
+            result = method(self, *args, **kwargs)
+            failed = False
+            return result
+        finally:
+            elapsed_ms = (time.time() - start) * 1000
+            _local.sample = None
+            _record('{}.{}'.format(type(self).__name__, method.__name__),
+                    elapsed_ms, sample, failed)
+    return wrapper
+
+
+def _record(name, elapsed_ms, sample, failed):
+    with _lock:
+        profile = _profiles.get(name)
+        if profile is None:
+            profile = _profiles[name] = Profile(name)
+        profile.add(elapsed_ms, sample, failed)
+
+
+def get_forms():
+    """Returns the ProfileForms of this instance, by method name"""
+    with _lock:
+        return [_profiles[name].to_form() for name in sorted(_profiles)]
+
+
+def reset():
+    """Drops the profiles of this instance"""
+    with _lock:
+        _profiles.clear()
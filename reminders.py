@@ -0,0 +1,95 @@
+"""reminders.py - Fan-out of the hourly reminder emails.
+
+The cron job walks the players with active games (their ActiveGames
+indexes) with a keys-only query, one page of BATCH_SIZE at a time, and
+enqueues one task per page carrying the cursors the page starts and ends at.
+The query is an equality filter on has_active, in key order, so a worker
+re-running its page between the two cursors reads the players of the cron's
+page, none skipped nor in another page, even if games changed since. Tasks
+are added MAX_TASKS_PER_ADD at a time. Each worker task reads its page of
+indexes and players in one batch and sends each player a single email
+listing all their games, and the reminders queue runs the workers in
+parallel.
+
+LocalMailer and LocalQueue stand in for the mail and taskqueue APIs so the
+pipeline can be benchmarked offline, see benchmarks/reminder_fanout.py."""
+
+import threading
+from collections import namedtuple
+
+BATCH_SIZE = 100
+MAX_TASKS_PER_ADD = 100
+QUEUE_NAME = 'reminders'
+WORKER_URL = '/tasks/send_reminders'
+SUBJECT = 'This is a reminder!'
+
+Reminder = namedtuple('Reminder', ['email', 'subject', 'body'])
+
+
+def chunks(items, size):
+    """Splits the items into lists of at most size items"""
+    return [items[start:start + size] for start in range(0, len(items), size)]
+
+
+def build_reminder(name, email, game_keys):
+    """Returns the reminder of a player with the urlsafe keys of their
+    active games"""
+    body = 'Hi {}, you have {} games in progress. Their keys are: {}.'.format(
+        name, len(game_keys), '\n'.join(game_keys))
+    return Reminder(email, SUBJECT, body)
+
+
+def send_reminders(reminders, send_mail, sender):
+    """Sends the reminders with send_mail(sender, to, subject, body).
+    Returns the number of emails sent"""
+    for reminder in reminders:
+        send_mail(sender, reminder.email, reminder.subject, reminder.body)
+    return len(reminders)
+
+
+class LocalMailer(object):
+    """Stand-in for mail.send_mail keeping the sent emails in memory"""
+
+    def __init__(self):
+        self.sent = []
+        self._lock = threading.Lock()
+
+    def __call__(self, sender, to, subject, body):
+        with self._lock:
+            self.sent.append((sender, to, subject, body))
+
+
+class LocalQueue(object):
+    """Stand-in for a push queue. Tasks are (url, params) pairs, run by
+    run() on a number of worker threads"""
+
+    def __init__(self):
+        self.tasks = []
+        self.adds = 0
+
+    def add(self, tasks):
+        self.adds += 1
+        self.tasks.extend(tasks)
+
+    def run(self, handler, workers):
+        """Calls handler(url, params) for every task, in parallel on the
+        workers. Returns the number of tasks run"""
+        tasks = list(reversed(self.tasks))
+        count = len(tasks)
+        self.tasks = []
+        lock = threading.Lock()
+
+        def work():
+            while True:
+                with lock:
+                    if not tasks:
+                        return
+                    url, params = tasks.pop()
+                handler(url, params)
+
+        threads = [threading.Thread(target=work) for _ in range(workers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return count
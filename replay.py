@@ -0,0 +1,82 @@
+"""replay.py - Replays the moves of games, one ply at a time.
+
+Moves come either as the (side, position) plies of a Game (Game.plies, see
+codec.py) or as the moves string of an exported record (export.py), the
+positions played as digits, the oppoent first. Boards are computed lazily, so
+looking at an intermediate position does not build the others, and records()
+reads an export file one line at a time, so millions of games are replayed in
+constant memory.
+
+    python replay.py games.ndjson            # final board of every game
+    python replay.py games.ndjson --ply 3    # board after the first 3 plies
+"""
+
+import argparse
+import itertools
+import json
+import sys
+
+import codec
+import engine
+
+
+def parse(moves):
+    """Returns the (side, position) plies of a moves string"""
+    return [(codec.HOST if index % 2 else codec.OPPOENT, int(move))
+            for index, move in enumerate(moves)]
+
+
+def boards(plies):
+    """Yields the (host_board, oppoent_board) after each ply"""
+    result = [0, 0]
+    for side, move in plies:
+        result[side] |= engine.bit(move)
+        yield result[codec.HOST], result[codec.OPPOENT]
+
+
+def board_at(plies, ply):
+    """Returns the (host_board, oppoent_board) after the first ply plies, or
+    the final boards if the game is shorter"""
+    board = (0, 0)
+    for board in itertools.islice(boards(plies), ply):
+        pass
+    return board
+
+
+def render(host_board, oppoent_board):
+    """Returns the board as a string of 9 cells, positions 1 to 9: X for the
+    oppoent, who moves first, O for the host and . for free positions"""
+    return ''.join('X' if oppoent_board & engine.bit(position) else
+                   'O' if host_board & engine.bit(position) else '.'
+                   for position in range(1, 10))
+
+
+def records(lines):
+    """Yields the export records of newline-delimited JSON lines"""
+    for line in lines:
+        line = line.strip()
+        if line:
+            yield json.loads(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('path', help='export file, - for stdin')
+    parser.add_argument('--ply', type=int, default=9,
+                        help='number of plies to replay (default: all)')
+    args = parser.parse_args()
+
+    stream = sys.stdin if args.path == '-' else open(args.path)
+    try:
+        for record in records(stream):
+            host_board, oppoent_board = board_at(parse(record['moves']),
+                                                 args.ply)
+            sys.stdout.write('{}\t{}\n'.format(
+                record['key'], render(host_board, oppoent_board)))
+    finally:
+        if stream is not sys.stdin:
+            stream.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,194 @@
+"""simulate.py - Batch self-play simulator for load and balance testing.
+
+Plays games between two agents and reports the outcome statistics:
+
+    random   plays any free position
+    greedy   wins if it can, otherwise blocks, otherwise plays at random
+    perfect  plays one of the best moves of the perfect-play table
+
+The oppoent goes first, like in a real Game. Every reachable position is
+numbered by its base 3 code (see engine.encode) and each agent's choices
+are precomputed as the codes it can move to, so playing a ply is a single
+random.choice. Games are split into chunks played by a process pool.
+
+    python simulate.py --games 1000000 --oppoent perfect --host random
+    python simulate.py --games 1000 --records moves.ndjson
+
+Move records are written as newline-delimited JSON, one game per line, with
+the history in the same [player_name, move] shape as Game.get_history().
+"""
+
+import argparse
+import json
+import multiprocessing
+import random
+import sys
+import timeit
+
+import engine
+import gametree
+
+AGENTS = ('random', 'greedy', 'perfect')
+
+# Results of a position, RESULTS[code].
+ONGOING, FIRST_WON, SECOND_WON, DRAW = range(4)
+
+CHUNK_SIZE = 100000
+
+# MOVES[delta] is the position (1-9) played when a code grows by delta.
+MOVES = dict((digit * 3 ** (position - 1), position)
+             for position in range(1, 10) for digit in (1, 2))
+
+
+def _build_tables():
+    """Returns the result of every position and, for each agent, the codes
+    it can move to from every position where the game is not over"""
+    results = [None] * gametree.SIZE
+    choices = dict((agent, [None] * gametree.SIZE) for agent in AGENTS)
+    stack = [(0, 0)]
+    while stack:
+        first, second = stack.pop()
+        code = engine.encode(first, second)
+        if results[code] is not None:
+            continue
+        if engine.is_winner(first):
+            results[code] = FIRST_WON
+        elif engine.is_winner(second):
+            results[code] = SECOND_WON
+        elif engine.is_full(first, second):
+            results[code] = DRAW
+        else:
+            results[code] = ONGOING
+        if results[code] != ONGOING:
+            continue
+
+        first_to_move = bin(first | second).count('1') % 2 == 0
+        mover, other = (first, second) if first_to_move else (second, first)
+        weight = 1 if first_to_move else 2
+        moves = engine.legal_moves(first, second)
+        winning = [move for move in moves
+                   if engine.is_winner(mover | engine.bit(move))]
+        blocking = [move for move in moves
+                    if engine.is_winner(other | engine.bit(move))]
+        best = gametree.lookup(first, second)[2]
+
+        def codes(positions):
+            return tuple(code + weight * 3 ** (position - 1)
+                         for position in positions)
+        choices['random'][code] = codes(moves)
+        choices['greedy'][code] = codes(winning or blocking or moves)
+        choices['perfect'][code] = codes(best)
+        for move in moves:
+            if first_to_move:
+                stack.append((first | engine.bit(move), second))
+            else:
+                stack.append((first, second | engine.bit(move)))
+    return results, choices
+
+
+RESULTS, CHOICES = _build_tables()
+
+
+def play(first_agent, second_agent, games, seed=None, record=False):
+    """Plays the games and returns the number of (first won, second won,
+    draw) games, and the list of move codes of every game if record is set"""
+    rng = random.Random(seed)
+    choice = rng.choice
+    results = RESULTS
+    first_choices = CHOICES[first_agent]
+    second_choices = CHOICES[second_agent]
+    counts = [0, 0, 0, 0]
+    games_codes = [] if record else None
+    for _ in range(games):
+        code = 0
+        codes = [0] if record else None
+        while True:
+            code = choice(first_choices[code])
+            if record:
+                codes.append(code)
+            result = results[code]
+            if result:
+                break
+            code = choice(second_choices[code])
+            if record:
+                codes.append(code)
+            result = results[code]
+            if result:
+                break
+        counts[result] += 1
+        if record:
+            games_codes.append(codes)
+    return counts[FIRST_WON], counts[SECOND_WON], counts[DRAW], games_codes
+
+
+def to_record(oppoent_name, host_name, codes):
+    """Returns the move record of a game played from the oppoent's side"""
+    names = (oppoent_name, host_name)
+    history = [[names[ply % 2], MOVES[codes[ply + 1] - codes[ply]]]
+               for ply in range(len(codes) - 1)]
+    result = ['Ongoing', oppoent_name, host_name, 'Tie'][RESULTS[codes[-1]]]
+    return {'oppoent': oppoent_name, 'host': host_name,
+            'history': history, 'winner': result}
+
+
+def _play_chunk(args):
+    return play(*args)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Self-play simulator for Tic-Tac-Toe agents')
+    parser.add_argument('--games', type=int, default=1000000)
+    parser.add_argument('--oppoent', default='random', choices=AGENTS,
+                        help='agent playing first')
+    parser.add_argument('--host', default='random', choices=AGENTS,
+                        help='agent playing second')
+    parser.add_argument('--processes', type=int,
+                        default=multiprocessing.cpu_count())
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--records', metavar='PATH',
+                        help='write the move records of every game to PATH')
+    args = parser.parse_args(argv)
+
+    chunks = []
+    for start in range(0, args.games, CHUNK_SIZE):
+        seed = None if args.seed is None else args.seed + start
+        chunks.append((args.oppoent, args.host,
+                       min(CHUNK_SIZE, args.games - start), seed,
+                       bool(args.records)))
+
+    oppoent_name = 'oppoent-' + args.oppoent
+    host_name = 'host-' + args.host
+    records = open(args.records, 'w') if args.records else None
+    totals = [0, 0, 0]
+    start = timeit.default_timer()
+    pool = multiprocessing.Pool(args.processes)
+    try:
+        for first_won, second_won, draws, games_codes in \
+                pool.imap_unordered(_play_chunk, chunks):
+            totals[0] += first_won
+            totals[1] += second_won
+            totals[2] += draws
+            if records:
+                for codes in games_codes:
+                    records.write(json.dumps(
+                        to_record(oppoent_name, host_name, codes)) + '\n')
+    finally:
+        pool.close()
+        pool.join()
+        if records:
+            records.close()
+    elapsed = timeit.default_timer() - start
+
+    games = sum(totals)
+    for name, count in zip((oppoent_name, host_name, 'tie'), totals):
+        sys.stdout.write('{:<16} {:>10} {:>7.2%}\n'.format(
+            name, count, float(count) / max(1, games)))
+    sys.stdout.write('{} games in {:.2f}s: {:.0f} games/s, {:.0f} games/s '
+                     'per process\n'.format(
+                         games, elapsed, games / elapsed,
+                         games / elapsed / args.processes))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+"""stats.py - Outcome statistics aggregated from the completed games.
+
+When a game ends, end_game enqueues an aggregation task with the
+transaction. The task adds the game's outcome (first player won, second
+player won or draw) to the sharded counters of every position the game went
+through, keyed by the symmetry class ID of the board (see symmetry.py), and
+the players' results to their opening profile: won/tied/lost per opening, as
+the first or the second player. An Aggregated marker written in the same
+transaction makes the task safe to run more than once, which lets the backfill
+job enqueue it for every completed game. Forfeited games are not aggregated.
+
+Position statistics are then a read of the position's counters, whatever the
+number of games played."""
+
+from google.appengine.ext import ndb
+
+import counters
+import engine
+import replay
+import symmetry
+from models import GameResult, Score
+
+FIRST_WON, SECOND_WON, DRAW = 'first', 'second', 'draw'
+OUTCOMES = (FIRST_WON, SECOND_WON, DRAW)
+FIRST, SECOND = 'first', 'second'
+AGGREGATE_URL = '/tasks/aggregate_game'
+BACKFILL_URL = '/tasks/backfill_stats'
+BACKFILL_BATCH = 100
+
+
+class Aggregated(ndb.Model):
+    """Marks a game as aggregated. Child of the Game"""
+
+    @classmethod
+    def key_for(cls, game_key):
+        return ndb.Key(cls, 1, parent=game_key)
+
+
+class OpeningProfile(ndb.Model):
+    """Results of a (human) player per opening, keyed by the player's ID.
+    openings maps the opening's symmetry class ID to the [won, tied, lost]
+    counts of the player as the FIRST and the SECOND player"""
+    openings = ndb.JsonProperty()
+
+    @classmethod
+    def key_for(cls, player_key):
+        return ndb.Key(cls, player_key.id())
+
+    def add(self, opening, side, result):
+        # None for a new profile
+        self.openings = dict(self.openings or {})
+        counts = self.openings.setdefault(str(opening), {}).setdefault(
+            side, [0, 0, 0])
+        # GameResult.Won, Tied and Lost are 0, 1 and 2
+        counts[result] += 1
+
+
+def position_counter(position, outcome):
+    """Returns the counter name of an outcome of a position"""
+    return 'position:{}:{}'.format(position, outcome)
+
+
+def positions(plies):
+    """Returns the symmetry class IDs of the boards after each ply"""
+    # The oppoent always goes first
+    return [symmetry.canonical(oppoent_board, host_board)[0]
+            for host_board, oppoent_board in replay.boards(plies)]
+
+
+def mover(position):
+    """Returns FIRST or SECOND, the player to move at the position"""
+    first_board, second_board = engine.decode(position)
+    marks = bin(first_board | second_board).count('1')
+    return SECOND if marks % 2 else FIRST
+
+
+@ndb.transactional(xg=True)
+def aggregate(game_key):
+    """Adds a completed game to the position counters and opening profiles.
+    Returns False if it was aggregated already or cannot be"""
+    marker_key = Aggregated.key_for(game_key)
+    game, score, marker = ndb.get_multi([game_key, Score.key_for(game_key),
+                                         marker_key])
+    if marker or not game or not score:
+        return False
+    entities = [Aggregated(key=marker_key)]
+    played_out = (engine.is_winner(game.host_board) or
+                  engine.is_winner(game.oppoent_board) or game.is_full())
+    if played_out:
+        if score.oppoent_result == GameResult.Won:
+            outcome = FIRST_WON
+        elif score.host_result == GameResult.Won:
+            outcome = SECOND_WON
+        else:
+            outcome = DRAW
+        entities += counters.increments(dict(
+            (position_counter(position, outcome), 1)
+            for position in positions(game.plies)))
+
+        players = [(game.oppoent, FIRST, score.oppoent_result),
+                   (game.host, SECOND, score.host_result)]
+        players = [player for player in players if not game.is_ai(player[0])]
+        keys = [OpeningProfile.key_for(player_key)
+                for player_key, _, _ in players]
+        for key, profile, (_, side, result) in zip(
+                keys, ndb.get_multi(keys), players):
+            profile = profile or OpeningProfile(key=key)
+            profile.add(game.opening, side, result)
+            entities.append(profile)
+    ndb.put_multi(entities)
+    return played_out
+
+
+def get_position_stats(position):
+    """Returns the number of games through the position won by the first
+    player, won by the second player and drawn"""
+    names = [position_counter(position, outcome) for outcome in OUTCOMES]
+    counts = counters.get_counts(names)
+    return [counts[name] for name in names]
@@ -0,0 +1,75 @@
+"""symmetry.py - Canonical positions under the 8 symmetries of the board.
+
+Two positions that are identical up to a rotation or a reflection of the
+board share the same symmetry class. The class ID is the smallest base 3
+code (see engine.encode) among the 8 transformed positions and the transform
+is the index in TRANSFORMS of the one that produces it, so a move on the
+canonical board can be mapped back to the actual board with untransform().
+"""
+
+import engine
+
+# Each transform maps a cell (row, column) of the board to its new cell.
+_CELL_TRANSFORMS = (
+    lambda row, col: (row, col),            # identity
+    lambda row, col: (col, 2 - row),        # rotate 90
+    lambda row, col: (2 - row, 2 - col),    # rotate 180
+    lambda row, col: (2 - col, row),        # rotate 270
+    lambda row, col: (row, 2 - col),        # reflect left-right
+    lambda row, col: (2 - row, col),        # reflect top-bottom
+    lambda row, col: (col, row),            # reflect main diagonal
+    lambda row, col: (2 - col, 2 - row),    # reflect anti diagonal
+)
+
+
+def _position_map(transform):
+    """Returns the new position (1-9) of every position under a transform"""
+    positions = []
+    for position in range(1, 10):
+        row, col = transform(*divmod(position - 1, 3))
+        positions.append(row * 3 + col + 1)
+    return tuple(positions)
+
+
+# TRANSFORMS[t][position - 1] is the position moved to by transform t.
+TRANSFORMS = tuple(_position_map(transform) for transform in _CELL_TRANSFORMS)
+
+# INVERSES[t][position - 1] is the position transform t moved there from.
+INVERSES = tuple(tuple(transform.index(position) + 1
+                       for position in range(1, 10))
+                 for transform in TRANSFORMS)
+
+# BOARD_TRANSFORMS[t][board] is the bitboard moved by transform t.
+BOARD_TRANSFORMS = tuple(
+    tuple(engine.to_board(transform[position - 1]
+                          for position in engine.POSITIONS[board])
+          for board in range(engine.FULL_BOARD + 1))
+    for transform in TRANSFORMS)
+
+# BOARD_INVERSES[t][board] undoes BOARD_TRANSFORMS[t][board].
+BOARD_INVERSES = tuple(
+    tuple(engine.to_board(inverse[position - 1]
+                          for position in engine.POSITIONS[board])
+          for board in range(engine.FULL_BOARD + 1))
+    for inverse in INVERSES)
+
+
+def canonical(first_board, second_board):
+    """Returns the (class ID, transform) of a position, where the boards
+    belong to the players who moved first and second"""
+    best_code = best_transform = None
+    for transform, boards in enumerate(BOARD_TRANSFORMS):
+        code = engine.encode(boards[first_board], boards[second_board])
+        if best_code is None or code < best_code:
+            best_code, best_transform = code, transform
+    return best_code, best_transform
+
+
+def is_canonical(code):
+    """Check if a base 3 code is the ID of its own symmetry class"""
+    return canonical(*engine.decode(code))[0] == code
+
+
+def untransform(board, transform):
+    """Maps a bitboard on the canonical board back to the actual board"""
+    return BOARD_INVERSES[transform][board]
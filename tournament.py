@@ -0,0 +1,282 @@
+"""tournament.py - Round-robin and single-elimination tournaments.
+
+A tournament is played in rounds. The games of a round are created by a task,
+a few per transaction along with the players' active games like new_game,
+and each of them records its tournament and round. The game of two players
+who still have another active game together waits, the task being retried
+until that game has ended. When a
+tournament game ends, end_game increments the sharded counter of finished
+games of its round and enqueues an advancement task, which compares the
+counter with the number of games of the round. Once the last game is done the
+results are read with one get_multi of the round's Scores, the standings
+updated and the task creating the next round enqueued. Nothing queries the
+games, so the work of a round is proportional to its number of games.
+
+Round-robin: every player meets every other player once, in n - 1 rounds for
+n players (Berger tables, one player sits out each round when n is odd), and
+moves first in half of their games. A win is worth WIN_POINTS and a tie
+TIE_POINTS; the winner has the most points, ties going to the player
+registered first.
+
+Single elimination: the winners of a round meet in the next one, in bracket
+order, and the last player of an odd round advances without playing. Since
+the second player can always hold a draw, a tied game is won by the host, who
+plays second."""
+
+from google.appengine.api import taskqueue
+from google.appengine.ext import ndb
+
+import counters
+from forms import TournamentForm
+from models import Game, GameState, GameResult, Score, ActiveGames, \
+    GameInSessionError, allocate_ids_async
+from utils import pretty_date
+
+ROUND_ROBIN, SINGLE_ELIMINATION = 'round_robin', 'single_elimination'
+FORMATS = (ROUND_ROBIN, SINGLE_ELIMINATION)
+# The roster and standings are held in the Tournament entity, about 120
+# bytes per player: this keeps it well under the 1MB entity limit
+MAX_PLAYERS = 4000
+# Two active games indexes and a game each: 24 entity groups
+PAIRS_PER_TRANSACTION = 8
+WIN_POINTS, TIE_POINTS = 2, 1
+ROUND_URL = '/tasks/create_tournament_round'
+
+
+class Tournament(ndb.Model):
+    """Tournament between players. round is the round being played, from 1.
+    points holds the round-robin points of the players, in the order of
+    players, and remaining the players still in a single-elimination
+    tournament"""
+    name = ndb.StringProperty(required=True)
+    format = ndb.StringProperty(required=True, choices=FORMATS)
+    players = ndb.KeyProperty(kind='Player', repeated=True, indexed=False)
+    points = ndb.IntegerProperty(repeated=True, indexed=False)
+    remaining = ndb.KeyProperty(kind='Player', repeated=True, indexed=False)
+    round = ndb.IntegerProperty(default=1, indexed=False)
+    status = ndb.IntegerProperty(default=GameState.Active)
+    winner = ndb.KeyProperty(kind='Player', indexed=False)
+    start_date = ndb.DateTimeProperty(auto_now_add=True)
+
+    @classmethod
+    @ndb.transactional
+    def create(cls, name, format, player_keys):
+        """Creates and returns a tournament between the players. The task
+        creating the first round is enqueued with the transaction"""
+        tournament = Tournament(name = name,
+                                format = format,
+                                players = player_keys,
+                                points = [0] * len(player_keys),
+                                remaining = player_keys)
+        tournament.put()
+        _enqueue_round(tournament.key, 1)
+        return tournament
+
+    @property
+    def rounds(self):
+        """The number of rounds of the tournament"""
+        count = len(self.players)
+        if self.format == ROUND_ROBIN:
+            return count - 1 + count % 2
+        return (count - 1).bit_length()
+
+    def to_form(self):
+        """Returns a TournamentForm representation of the Tournament"""
+        status_list = ['Active', 'Completed']
+        winner = self.winner.get() if self.winner else None
+        return TournamentForm(urlsafe_key = self.key.urlsafe(),
+            name = self.name,
+            format = self.format,
+            players = len(self.players),
+            round = self.round,
+            rounds = self.rounds,
+            status = status_list[self.status],
+            winner_name = winner.name if winner else None,
+            start_date = pretty_date(self.start_date))
+
+
+class TournamentRound(ndb.Model):
+    """Games of a tournament round and the players of each, child of the
+    Tournament keyed by the round number. byes are the players advancing
+    without playing"""
+    games = ndb.KeyProperty(kind='Game', repeated=True, indexed=False)
+    hosts = ndb.KeyProperty(kind='Player', repeated=True, indexed=False)
+    oppoents = ndb.KeyProperty(kind='Player', repeated=True, indexed=False)
+    byes = ndb.KeyProperty(kind='Player', repeated=True, indexed=False)
+
+    @classmethod
+    def key_for(cls, tournament_key, number):
+        return ndb.Key(cls, number, parent=tournament_key)
+
+
+def round_robin_pairs(players, number):
+    """Returns the (host, oppoent) pairs of a round-robin round, from 1 to
+    the number of rounds, the oppoent moving first. Berger tables: the first
+    position stays in place and the others rotate by one position each round.
+    The player in the first half of the order moves first, but the fixed
+    position alternates, so that each player moves first in (n - 1) / 2
+    games, rounded either way. With an odd number of players the fixed
+    position is the one sitting out"""
+    players = list(players)
+    if len(players) % 2:
+        players.insert(0, None)
+    count = len(players)
+    turn = (number - 1) % (count - 1)
+    rest = players[1:]
+    order = [players[0]] + rest[len(rest) - turn:] + rest[:len(rest) - turn]
+    pairs = []
+    for index in range(count // 2):
+        first, second = order[index], order[count - 1 - index]
+        if first is None or second is None:
+            continue
+        if index == 0 and number % 2 == 0:
+            first, second = second, first
+        pairs.append((second, first))
+    return pairs
+
+
+def elimination_pairs(players):
+    """Returns the (host, oppoent) pairs of a single-elimination round and
+    the player advancing without playing, or None"""
+    pairs = [(players[index], players[index + 1])
+             for index in range(0, len(players) - 1, 2)]
+    return pairs, players[-1] if len(players) % 2 else None
+
+
+def _enqueue_round(tournament_key, number):
+    taskqueue.add(url=ROUND_URL,
+                  params={'tournament_key': tournament_key.urlsafe(),
+                          'round': number},
+                  transactional=ndb.in_transaction())
+
+
+@ndb.transactional
+def _plan_round(tournament_key, number):
+    """Returns the round, pairing its players and allocating the keys of its
+    games the first time"""
+    key = TournamentRound.key_for(tournament_key, number)
+    planned = key.get()
+    if planned:
+        return planned
+    tournament = tournament_key.get()
+    if tournament.format == ROUND_ROBIN:
+        pairs, bye = round_robin_pairs(tournament.players, number), None
+    else:
+        pairs, bye = elimination_pairs(tournament.remaining)
+    first, _ = allocate_ids_async(Game, len(pairs)).get_result()
+    planned = TournamentRound(key = key,
+        games = [ndb.Key(Game, first + index) for index in range(len(pairs))],
+        hosts = [host for host, _ in pairs],
+        oppoents = [oppoent for _, oppoent in pairs],
+        byes = [bye] if bye else [])
+    planned.put()
+    return planned
+
+
+def create_round(tournament_key, number):
+    """Creates the games of a round and adds them to the players' active
+    games, PAIRS_PER_TRANSACTION games per transaction. Safe to run more
+    than once. Returns the number of games created. Raises
+    GameInSessionError, after creating the other games, if players of the
+    round still have an active game together: the task is retried until
+    they are done with it"""
+    planned = _plan_round(tournament_key, number)
+    pairs = zip(planned.games, planned.hosts, planned.oppoents)
+    futures = [_create_games_async(tournament_key, number,
+                                   pairs[start:start + PAIRS_PER_TRANSACTION])
+               for start in range(0, len(pairs), PAIRS_PER_TRANSACTION)]
+    results = [future.get_result() for future in futures]
+    waiting = sum(waiting for _, waiting in results)
+    if waiting:
+        raise GameInSessionError(
+            'Round {}: {} games wait for their players to end another game '
+            'together'.format(number, waiting))
+    return sum(created for created, _ in results)
+
+
+@ndb.transactional_tasklet(xg=True)
+def _create_games_async(tournament_key, number, pairs):
+    """Creates the games of (game key, host, oppoent) pairs, like
+    Game.new_game, in the same transaction as the players' active games.
+    Leaves out the games created already and those of players who have an
+    active game together. Returns the numbers of games created and left
+    out"""
+    game_keys = [key for key, _, _ in pairs]
+    players = [player for _, host, oppoent in pairs
+               for player in (host, oppoent)]
+    existing, indexes = yield (ndb.get_multi_async(game_keys),
+                               ActiveGames.get_multi_for_async(players))
+    indexes = dict((index.player, index) for index in indexes)
+    entities = []
+    waiting = 0
+    for (key, host, oppoent), game in zip(pairs, existing):
+        if game:
+            continue
+        if oppoent in indexes[host].get_oppoents():
+            waiting += 1
+            continue
+        indexes[host].add(key, oppoent)
+        indexes[oppoent].add(key, host)
+        entities += [Game(key = key,
+                          host = host,
+                          oppoent = oppoent,
+                          next_turn = oppoent,
+                          tournament = tournament_key,
+                          round = number),
+                     indexes[host], indexes[oppoent]]
+    if entities:
+        yield ndb.put_multi_async(entities)
+    raise ndb.Return(len(entities) // 3, waiting)
+
+
+def advance(tournament_key, number):
+    """Closes the round and starts the next one, or ends the tournament, if
+    all the games of the round are finished. Safe to run more than once.
+    Returns True if the round was closed"""
+    planned = TournamentRound.key_for(tournament_key, number).get()
+    if not planned:
+        return False
+    name = Game.round_counter(tournament_key, number)
+    # Read the shards: the cached total may not be offset yet.
+    if counters.get_counts([name], cached=False)[name] < len(planned.games):
+        return False
+    scores = ndb.get_multi([Score.key_for(key) for key in planned.games])
+    if not all(scores):
+        return False
+    return _close_round(tournament_key, number, planned, scores)
+
+
+@ndb.transactional
+def _close_round(tournament_key, number, planned, scores):
+    tournament = tournament_key.get()
+    if tournament.status == GameState.Completed or tournament.round != number:
+        return False
+    if tournament.format == ROUND_ROBIN:
+        points = {GameResult.Won: WIN_POINTS, GameResult.Tied: TIE_POINTS}
+        positions = dict((key, index)
+                         for index, key in enumerate(tournament.players))
+        for score in scores:
+            tournament.points[positions[score.host]] += points.get(
+                score.host_result, 0)
+            tournament.points[positions[score.oppoent]] += points.get(
+                score.oppoent_result, 0)
+        if number == tournament.rounds:
+            best = max(range(len(tournament.players)),
+                       key=lambda index: (tournament.points[index], -index))
+            tournament.winner = tournament.players[best]
+    else:
+        # The host also advances on a tie
+        winners = [score.oppoent if score.host_result == GameResult.Lost
+                   else score.host for score in scores]
+        # The bye goes first so that another player sits out next time
+        tournament.remaining = planned.byes + winners
+        if len(tournament.remaining) == 1:
+            tournament.winner = tournament.remaining[0]
+
+    if tournament.winner:
+        tournament.status = GameState.Completed
+    else:
+        tournament.round += 1
+        _enqueue_round(tournament.key, tournament.round)
+    tournament.put()
+    return True
@@ -1,20 +1,22 @@
 """utils.py - File for collecting general utility functions."""
 
 import logging
+from datetime import datetime
 from google.appengine.ext import ndb
+from google.appengine.datastore.datastore_query import Cursor
 import endpoints
 
-def get_by_urlsafe(urlsafe, model):
-    """Returns an ndb.Model entity that the urlsafe key points to. Checks
-        that the type of entity returned is of the correct kind. Raises an
-        error if the key String is malformed or the entity is of the incorrect
-        kind
+import cache
+
+def get_key_by_urlsafe(urlsafe, model):
+    """Returns the ndb.Key that the urlsafe key points to, without reading
+        the entity. Raises an error if the key String is malformed or the
+        key is of the incorrect kind
     Args:
         urlsafe: A urlsafe key string
         model: The expected entity kind
     Returns:
-        The entity that the urlsafe Key string points to or None if no entity
-        exists.
+        The Key that the urlsafe Key string points to.
     Raises:
         ValueError:"""
     try:
@@ -27,13 +29,43 @@ def get_by_urlsafe(urlsafe, model):
         else:
             raise
 
-    entity = key.get()
+    if key.kind() != model._get_kind():
+        raise ValueError('Incorrect Kind')
+    return key
+
+def get_by_urlsafe(urlsafe, model):
+    """Returns an ndb.Model entity that the urlsafe key points to. Checks
+        that the type of entity returned is of the correct kind. Raises an
+        error if the key String is malformed or the entity is of the incorrect
+        kind
+    Args:
+        urlsafe: A urlsafe key string
+        model: The expected entity kind
+    Returns:
+        The entity that the urlsafe Key string points to or None if no entity
+        exists. Models derived from cache.CachedModel are read through
+        memcache.
+    Raises:
+        ValueError:"""
+    key = get_key_by_urlsafe(urlsafe, model)
+    if issubclass(model, cache.CachedModel):
+        entity = cache.get(key)
+    else:
+        entity = key.get()
     if not entity:
         return None
-    if not isinstance(entity, model):
-        raise ValueError('Incorrect Kind')
     return entity
 
+def get_cursor_by_urlsafe(urlsafe):
+    """Returns the query Cursor of a urlsafe cursor string, or None if the
+        string is empty. Raises an error if the cursor String is malformed"""
+    if not urlsafe:
+        return None
+    try:
+        return Cursor(urlsafe=urlsafe)
+    except Exception:
+        raise endpoints.BadRequestException('Invalid Cursor')
+
 def pretty_date(time=False):
     """Get a datetime object or a int() Epoch timestamp and return a
     pretty string like 'an hour ago', 'Yesterday', '3 months ago',
@@ -74,23 +106,3 @@ def pretty_date(time=False):
     if day_diff < 365:
         return str(day_diff / 30) + ' months ago'
     return str(day_diff / 365) + ' years ago'
-
-def check_winner(moves):
-    """Check against all possible win patterns to see if player has won or not"""
-    win_patterns = [[1,2,3], [4,5,6], [7,8,9], [1,4,7], [2,5,8], [3,6,9], [1,5,9], [3,5,7]]
-    sorted_moves = moves.sort()
-    if len(moves) >= 3:
-        for pattern in win_patterns:
-            if set(pattern) < set(sorted_moves):
-                return True
-        return False
-    else:
-        return False
-
-def check_full(moves):
-    """Check is the borad is empty"""
-    if len(moves) > 0:
-        return False
-    else:
-        return True
-